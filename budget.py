@@ -0,0 +1,95 @@
+import inspect
+import time
+from typing import Dict, Any, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+from config import PROMPT_TOKEN_BUDGETS, BUDGET_REPORT_OUTPUT_TOKENS, BUDGET_REPORT_RESERVE_SECONDS
+from token_utils import estimate_tokens, start_usage_meter, stop_usage_meter
+from tracing import span
+
+# 一轮研究包含的节点，用于估算再进行一轮的成本
+ITERATION_NODES = ("planner", "researcher", "synthesizer")
+
+
+def metered(node_name: str, node):
+    """包装图节点：记录该节点本次执行的 LLM token 用量与耗时，追加到 node_costs，并记录为追踪中的节点 span。"""
+    accepts_config = "config" in inspect.signature(node).parameters
+
+    async def wrapper(state, config: RunnableConfig = None):
+        # 恢复执行的研究由 main 在 configurable 中给出累计中断时长，随节点输出写入状态
+        paused_seconds = ((config or {}).get("configurable") or {}).get("paused_seconds")
+        meter, token = start_usage_meter()
+        start = time.time()
+        attrs = {"iteration": state.get("current_iteration", 0)}
+        if state.get("sub_task"):
+            attrs["sub_task"] = state["sub_task"]
+        try:
+            with span(node_name, "node", **attrs) as span_attrs:
+                result = await (node(state, config) if accepts_config else node(state))
+                span_attrs.update(tokens=meter["tokens"], llm_calls=meter["calls"])
+        finally:
+            stop_usage_meter(token)
+        cost = {
+            "node": node_name,
+            "iteration": state.get("current_iteration", 0),
+            "tokens": meter["tokens"],
+            "calls": meter["calls"],
+            "seconds": round(time.time() - start, 3),
+        }
+        update = {**(result or {}), "node_costs": [cost]}
+        if paused_seconds:
+            update["paused_seconds"] = paused_seconds
+        return update
+
+    wrapper.__name__ = getattr(node, "__name__", node_name)
+    return wrapper
+
+
+def budget_usage(state) -> Dict[str, Any]:
+    # 汇总已用预算：总 token、总耗时（不含中断到恢复之间的时间）与按节点的用量
+    per_node: Dict[str, Dict[str, float]] = {}
+    for cost in state.get("node_costs") or []:
+        entry = per_node.setdefault(cost["node"], {"tokens": 0, "calls": 0, "seconds": 0.0})
+        entry["tokens"] += cost["tokens"]
+        entry["calls"] += cost["calls"]
+        entry["seconds"] = round(entry["seconds"] + cost["seconds"], 3)
+    started_at = state.get("started_at") or time.time()
+    return {
+        "tokens_used": sum(entry["tokens"] for entry in per_node.values()),
+        "token_budget": state.get("token_budget") or None,
+        "elapsed_seconds": round(time.time() - started_at - (state.get("paused_seconds") or 0), 3),
+        "time_budget": state.get("time_budget") or None,
+        "per_node": per_node,
+    }
+
+
+def _report_reserve(state) -> Dict[str, float]:
+    # 为 final_report 预留的预算：提示词（累积发现 + 证据片段）加输出，耗时取单次合成的最长耗时与配置下限的较大者
+    synth_seconds = [c["seconds"] for c in state.get("node_costs") or [] if c["node"] == "synthesizer"]
+    return {
+        "tokens": estimate_tokens(state.get("accumulated_findings", "")) + PROMPT_TOKEN_BUDGETS["final_report"] + BUDGET_REPORT_OUTPUT_TOKENS,
+        "seconds": max([BUDGET_REPORT_RESERVE_SECONDS] + synth_seconds),
+    }
+
+
+def budget_exhausted(state) -> Optional[str]:
+    """按已完成轮次的平均成本预估下一轮的开销，扣除 final_report 的预留后预算不足时返回原因。"""
+    token_budget = state.get("token_budget") or 0
+    time_budget = state.get("time_budget") or 0
+    if not token_budget and not time_budget:
+        return None
+    iterations = max(1, state.get("current_iteration", 0))
+    usage = budget_usage(state)
+    reserve = _report_reserve(state)
+    if token_budget:
+        iteration_tokens = sum(c["tokens"] for c in state.get("node_costs") or [] if c["node"] in ITERATION_NODES) / iterations
+        remaining = token_budget - usage["tokens_used"] - reserve["tokens"]
+        if remaining < iteration_tokens:
+            return f"token 预算不足：剩余 {remaining:.0f}，预计下一轮需要 {iteration_tokens:.0f}"
+    if time_budget:
+        iteration_seconds = usage["elapsed_seconds"] / iterations
+        remaining = time_budget - usage["elapsed_seconds"] - reserve["seconds"]
+        if remaining < iteration_seconds:
+            return f"时间预算不足：剩余 {remaining:.1f} 秒，预计下一轮需要 {iteration_seconds:.1f} 秒"
+    return None
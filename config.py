@@ -2,6 +2,9 @@ import os
 import google.generativeai as genai
 from browser_use.llm.google.chat import ChatGoogle
 from browser_use.llm.ollama.chat import ChatOllama
+from llm_cache import CachedChatModel
+from llm_gateway import LLMGateway, GatedChatModel
+from tracing import TraceStore
 
 os.environ["HTTP_PROXY"] = "http://127.0.0.1:7897"
 # os.environ["HTTPS_PROXY"] = "https://127.0.0.1:7897"
@@ -16,6 +19,216 @@ genai.configure(api_key=GOOGLE_API_KEY)
 #     temperature=0.5,
 # )
 
-LLM = ChatOllama(
-    model="Qwen3:0.6b",
-)
\ No newline at end of file
+# --- LLM 响应缓存 ---
+# 按模型名 + 采样参数 + 提示消息哈希做精确匹配；ZERO_TEMPERATURE_ONLY 为 True 时只缓存温度为 0 的模型
+# 条目超过 TTL（秒）失效，总数超过 MAX_ENTRIES 时按最近访问时间淘汰
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "cache/llm_cache.sqlite3"
+LLM_CACHE_ZERO_TEMPERATURE_ONLY = False
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 20000
+
+# --- LLM 调用网关 ---
+# 同一后端（服务地址）的所有 LLM 调用共享一个自适应并发上限：流式调用的每输出 token 解码时间、非流式调用的
+# 总延迟（按提示与输出 token 数分桶）超过同类请求近期最小值的
+# LATENCY_TOLERANCE 倍或出现瞬时错误时按 BACKOFF_RATIO 下调（冷却期内最多一次），占满上限且延迟正常时逐步上调
+LLM_GATEWAY_MIN_CONCURRENCY = 1
+LLM_GATEWAY_MAX_CONCURRENCY = 8
+LLM_GATEWAY_INITIAL_CONCURRENCY = 2
+LLM_GATEWAY_LATENCY_TOLERANCE = 2.0
+LLM_GATEWAY_BACKOFF_RATIO = 0.7
+LLM_GATEWAY_DECREASE_COOLDOWN = 5
+# 瞬时错误（超时、连接错误、429/5xx）的重试次数与全抖动指数退避的基础/最大间隔（秒）
+LLM_GATEWAY_RETRIES = 2
+LLM_GATEWAY_RETRY_BASE_DELAY = 0.5
+LLM_GATEWAY_RETRY_MAX_DELAY = 8
+
+LLM_GATEWAY = LLMGateway(
+    min_concurrency=LLM_GATEWAY_MIN_CONCURRENCY,
+    max_concurrency=LLM_GATEWAY_MAX_CONCURRENCY,
+    initial_concurrency=LLM_GATEWAY_INITIAL_CONCURRENCY,
+    latency_tolerance=LLM_GATEWAY_LATENCY_TOLERANCE,
+    backoff_ratio=LLM_GATEWAY_BACKOFF_RATIO,
+    decrease_cooldown=LLM_GATEWAY_DECREASE_COOLDOWN,
+    retries=LLM_GATEWAY_RETRIES,
+    retry_base_delay=LLM_GATEWAY_RETRY_BASE_DELAY,
+    retry_max_delay=LLM_GATEWAY_RETRY_MAX_DELAY,
+)
+
+def ollama_model(model: str, **kwargs) -> CachedChatModel:
+    # 带响应缓存的 Ollama 模型（未命中缓存的调用经过 LLM 网关），供 MODEL_ROUTES 组合各节点的模型链
+    return CachedChatModel(
+        GatedChatModel(ChatOllama(model=model, **kwargs), LLM_GATEWAY),
+        path=LLM_CACHE_PATH,
+        enabled=LLM_CACHE_ENABLED,
+        zero_temperature_only=LLM_CACHE_ZERO_TEMPERATURE_ONLY,
+        ttl=LLM_CACHE_TTL,
+        max_entries=LLM_CACHE_MAX_ENTRIES,
+    )
+
+LLM = ollama_model("Qwen3:0.6b")
+
+# --- 搜索配置 ---
+SEARXNG_URL = "https://search.mdosch.de"
+# SearXNG 实例池：按延迟加权选择，超过 p95 未返回时向另一个实例发起对冲请求
+SEARXNG_URLS = [SEARXNG_URL]
+SEARCH_TIMEOUT = 15
+# 连接池：全局连接上限 / keep-alive 连接上限 / 单个主机的并发上限
+SEARCH_MAX_CONNECTIONS = 100
+SEARCH_MAX_KEEPALIVE = 20
+SEARCH_PER_HOST_LIMIT = 8
+# 对冲请求的最小等待时间（秒），实际等待取该值与实例 p95 延迟的较大者
+SEARCH_HEDGE_MIN_DELAY = 0.5
+# 熔断：连续失败次数达到阈值后熔断，冷却期过后放行一次探测请求
+SEARCH_BREAKER_FAILURES = 3
+SEARCH_BREAKER_COOLDOWN = 30
+# 搜索结果缓存：SQLite 文件路径 / 过期时间（秒）/ 最大条目数（超出后按 LRU 淘汰）
+SEARCH_CACHE_PATH = "cache/search_cache.sqlite3"
+SEARCH_CACHE_TTL = 6 * 3600
+SEARCH_CACHE_MAX_ENTRIES = 5000
+
+# --- 研究流程 ---
+# 增量合成：synthesizer 只把新增研究结果与已有累积发现一起交给 LLM，而不是每轮重建全部历史
+SYNTHESIZER_INCREMENTAL = True
+# 流式生成：最终报告（及可选的综合结果）逐 token 推送到进度通道
+STREAM_FINAL_REPORT = True
+STREAM_SYNTHESIZER = False
+# 并行分发：planner 拆出的子问题数量上限，以及单次研究中同时运行的节点数上限
+FANOUT_WIDTH = 3
+FANOUT_MAX_CONCURRENCY = 3
+
+# --- 网页抓取 ---
+# 对搜索结果前 FETCH_TOP_K 个链接并发抓取正文；全局与单域名并发上限、总超时（秒）、响应体大小上限（字节）
+FETCH_ENABLED = True
+FETCH_TOP_K = 3
+FETCH_MAX_CONCURRENCY = 8
+FETCH_PER_DOMAIN_LIMIT = 2
+FETCH_TIMEOUT = 10
+FETCH_MAX_BYTES = 2 * 1024 * 1024
+# 每个页面送入研究提示词的正文字符上限
+FETCH_MAX_CHARS_PER_PAGE = 2000
+# 抽取后的正文保存在 SQLite 中，过期前重复出现的链接不再抓取
+PAGE_STORE_PATH = "cache/pages.sqlite3"
+PAGE_STORE_TTL = 24 * 3600
+PAGE_STORE_MAX_ENTRIES = 5000
+# 搜索结果中的链接只抓取 http(s) 且解析到公网地址的页面（每次重定向都会重新校验）；内网部署需要抓取内网页面时设为 True
+FETCH_ALLOW_PRIVATE_HOSTS = False
+
+# --- 本地检索索引 ---
+# 抓取到的文档切块后建立 BM25 倒排索引，各节点只取与当前任务相关的片段，受各自的 token 预算约束
+RETRIEVAL_ENABLED = True
+RETRIEVAL_CHUNK_TOKENS = 200
+# 跨研究共享的全局索引（按块数上限淘汰最早的块）
+RETRIEVAL_CROSS_RUN = False
+RETRIEVAL_MAX_GLOBAL_CHUNKS = 20000
+PROMPT_TOKEN_BUDGETS = {
+    "researcher": 2500,
+    "synthesizer": 2500,
+    "final_report": 1500,
+}
+
+# --- 近似重复来源去重 ---
+# 对摘要与正文计算 SimHash 指纹，海明距离不超过阈值视为同一来源的转载，仅保留一份并合并引用链接
+DEDUP_ENABLED = True
+DEDUP_SIMHASH_BITS = 64
+DEDUP_MAX_DISTANCE = 3
+
+# --- 研究任务调度 ---
+# 同时运行的研究数、排队上限、单个客户端排队+运行中的研究上限；超出时拒绝新提交
+SCHEDULER_MAX_WORKERS = 2
+SCHEDULER_MAX_QUEUE = 50
+SCHEDULER_MAX_PER_CLIENT = 5
+# 成功完成的研究在该时间（秒）内可被相同的研究请求直接复用，0 表示不复用
+RESEARCH_REUSE_TTL = 3600
+
+# --- 研究报告存储 ---
+# 完成的报告持久化到 SQLite（WAL），按 run_id 查询、按完成时间分页、支持全文检索
+REPORT_STORE_PATH = "cache/reports.sqlite3"
+# 报告保留天数与总数上限，超出后删除最早的报告；0 表示不限制
+REPORT_RETENTION_DAYS = 30
+REPORT_MAX_COUNT = 1000
+# 内存中保留的已完成研究进度条数，超出后淘汰最早完成的（报告本身仍可从存储中读取）
+RESEARCH_PROGRESS_MAX_COMPLETED = 100
+
+# --- 检查点与断点恢复 ---
+# 每个节点完成后将研究状态写入本地检查点（需安装 langgraph-checkpoint-sqlite，否则退回内存检查点）
+CHECKPOINT_ENABLED = True
+CHECKPOINT_PATH = "cache/checkpoints.sqlite3"
+# 研究成功完成后是否保留其检查点（False 时删除以节省空间）
+CHECKPOINT_KEEP_COMPLETED = False
+
+# --- 收敛检测（提前结束） ---
+# 每轮合成后计算边际新颖度（累积发现的 n-gram 新增比例与新来源比例的加权平均），
+# 连续低于阈值时不再规划新一轮研究，直接生成最终报告
+EARLY_STOP_ENABLED = True
+NOVELTY_THRESHOLD = 0.15
+NOVELTY_NGRAM = 3
+NOVELTY_SOURCE_WEIGHT = 0.5
+# 至少完成的研究轮数，以及需要连续低于阈值的轮数
+NOVELTY_MIN_ITERATIONS = 2
+NOVELTY_PATIENCE = 1
+
+# --- 时间与 token 预算 ---
+# /research 可传入 time_budget（秒）与 token_budget：预计再做一轮会超出剩余预算时不再规划新一轮，
+# 直接生成最终报告；始终为 final_report 预留输出 token 与耗时
+BUDGET_REPORT_OUTPUT_TOKENS = 1500
+BUDGET_REPORT_RESERVE_SECONDS = 20
+
+# --- 按节点的模型路由 ---
+# 每个图节点使用独立的模型链（调用失败或超时后依次回退到下一个模型）、并发上限与单次调用超时（秒）；
+# 未列出的节点使用 default。例如让报告使用更大的模型、失败时回退到小模型：
+# "final_report_generator": {"models": [ollama_model("qwen3:8b"), LLM], "max_concurrency": 1, "timeout": 300},
+MODEL_ROUTES = {
+    "default": {"models": [LLM], "max_concurrency": 4, "timeout": 120},
+    "planner": {"models": [LLM], "max_concurrency": 4, "timeout": 60},
+    "researcher": {"models": [LLM], "max_concurrency": 4, "timeout": 90},
+    "synthesizer": {"models": [LLM], "max_concurrency": 2, "timeout": 120},
+    "final_report_generator": {"models": [LLM], "max_concurrency": 1, "timeout": 300},
+}
+
+# --- 搜索结果的分批摘要（map-reduce） ---
+# researcher 把来源片段按 token 上限分批，各批并发摘要后逐层合并（每次最多合并 FAN_IN 份），
+# 耗时取决于批大小而非来源总量；并发度受模型路由与 LLM 网关限制
+MAP_REDUCE_ENABLED = True
+MAP_REDUCE_BATCH_TOKENS = 1200
+MAP_REDUCE_FAN_IN = 4
+
+# --- 研究计划复用与预取 ---
+# 带计划提交的研究直接从 researcher 开始，已确认的计划作为第一轮任务，不再重跑 planner
+PLAN_WARM_START = True
+# /plan 的结果按归一化查询缓存（秒 / 条数上限），重复查询直接返回
+PLAN_CACHE_TTL = 3600
+PLAN_CACHE_MAX_ENTRIES = 500
+# /plan 生成计划的同时在后台预取搜索结果与网页正文，研究开始时直接命中缓存；每个缓存的计划只预取一次，
+# 同时进行的预取任务数上限为 PLAN_SPECULATIVE_MAX_TASKS
+PLAN_SPECULATIVE_SEARCH = True
+PLAN_SPECULATIVE_MAX_TASKS = 8
+
+# --- 查询改写与多查询检索 ---
+# researcher 先把当前任务改写为若干条关键词搜索查询（跳过本次研究中已发出过的查询）并发检索，
+# 再用倒数排名融合（RRF，常数 k）合并各查询的结果，保留前 FUSED_RESULTS 条
+QUERY_REWRITE_ENABLED = True
+QUERY_REWRITE_COUNT = 3
+RRF_K = 60
+FUSED_RESULTS = 10
+
+# --- 流水线预取 ---
+# researcher 改写查询时多生成 PIPELINE_PREFETCH_QUERIES 条候选查询；synthesizer 合成本轮结果的同时在后台检索这些候选，
+# 下一轮 researcher 优先选用已预取的查询，未被选用的预取结果在下一轮合成开始或研究结束时丢弃
+PIPELINE_PREFETCH_ENABLED = True
+PIPELINE_PREFETCH_QUERIES = 2
+
+# --- 运行追踪 ---
+# 每次研究记录节点、LLM 调用、搜索与网页抓取的 span（耗时、token、缓存命中、数据量），
+# 内存中保留最近 TRACE_MAX_RUNS 次研究，单次研究最多 TRACE_MAX_SPANS 个 span；见 /runs/{run_id}/profile 与 /runs/{run_id}/trace
+TRACE_ENABLED = True
+TRACE_MAX_RUNS = 100
+TRACE_MAX_SPANS = 5000
+
+TRACE_STORE = TraceStore(enabled=TRACE_ENABLED, max_runs=TRACE_MAX_RUNS, max_spans=TRACE_MAX_SPANS)
+
+# --- 运行指标 ---
+# GET /metrics 以 Prometheus 文本格式输出节点 / LLM / 搜索延迟直方图、队列深度、缓存命中率、错误数与事件循环延迟；
+# 事件循环延迟每 METRICS_LOOP_LAG_INTERVAL 秒采样一次
+METRICS_ENABLED = True
+METRICS_LOOP_LAG_INTERVAL = 0.5
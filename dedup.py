@@ -0,0 +1,57 @@
+import hashlib
+from collections import Counter
+from typing import Dict, List, Any, Tuple
+
+from config import DEDUP_SIMHASH_BITS, DEDUP_MAX_DISTANCE
+from retrieval import tokenize
+from token_utils import estimate_tokens
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=DEDUP_SIMHASH_BITS // 8).digest(), "big")
+
+
+def simhash(text: str, bits: int = DEDUP_SIMHASH_BITS) -> int:
+    # 以分词结果为特征、词频为权重计算 SimHash 指纹
+    weights = [0] * bits
+    for feature, count in Counter(tokenize(text)).items():
+        h = _feature_hash(feature)
+        for i in range(bits):
+            weights[i] += count if h >> i & 1 else -count
+    fingerprint = 0
+    for i, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << i
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def dedupe_sources(sources: List[Dict[str, Any]], max_distance: int = DEDUP_MAX_DISTANCE) -> Tuple[List[Dict[str, Any]], int]:
+    """合并近似重复的来源。
+
+    每个来源是带 url、title、text 的字典；保留每组中第一个出现的来源，其余来源的 URL
+    合并到保留者的 urls 中作为引用。返回 (去重后的来源, 省下的估算 token 数)。
+    """
+    kept = []
+    fingerprints = []
+    tokens_saved = 0
+    for source in sources:
+        text = source.get("text") or ""
+        fingerprint = simhash(text) if text else None
+        duplicate_of = None
+        if fingerprint is not None:
+            for i, other in enumerate(fingerprints):
+                if other is not None and hamming_distance(fingerprint, other) <= max_distance:
+                    duplicate_of = kept[i]
+                    break
+        if duplicate_of is not None:
+            if source["url"] not in duplicate_of["urls"]:
+                duplicate_of["urls"].append(source["url"])
+            tokens_saved += estimate_tokens(text)
+            continue
+        kept.append({**source, "urls": [source["url"]]})
+        fingerprints.append(fingerprint)
+    return kept, tokens_saved
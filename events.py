@@ -0,0 +1,70 @@
+import asyncio
+from collections import deque
+from typing import Callable, Dict, List, Any, Optional
+
+# 每个订阅者缓存的未读瞬时事件上限，消费过慢时丢弃最早的
+TRANSIENT_BUFFER = 1000
+
+
+class EventChannel:
+    """单次研究的进度事件序列，供 SSE 推送。
+
+    事件按发布顺序编号并全部保留，订阅者可从任意编号续订（对应 SSE 的 Last-Event-ID）。
+    瞬时事件（如流式 token）不编号也不保留，只推送给当前的订阅者；断线重连时由订阅时的快照补齐。
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        # 最近一次推送的状态，供发布方判断状态是否变化
+        self.last_state = None
+        self._waiter = asyncio.Event()
+        # 各订阅者的未读瞬时事件：(发布时已有的编号事件数, 事件)
+        self._listeners: List[deque] = []
+
+    def publish(self, event_type: str, data: Any, transient: bool = False):
+        if transient:
+            event = (len(self.events), {"id": None, "type": event_type, "data": data})
+            for pending in self._listeners:
+                pending.append(event)
+        else:
+            self.events.append({"id": len(self.events), "type": event_type, "data": data})
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        # 唤醒当前所有等待者，并为下一批等待者换一个新的 Event
+        waiter, self._waiter = self._waiter, asyncio.Event()
+        waiter.set()
+
+    async def listen(self, start: int = 0, heartbeat: Optional[float] = None,
+                     snapshot: Optional[Callable[[], Optional[Dict[str, Any]]]] = None):
+        # 依次产出 start 之后的事件（瞬时事件按发布顺序穿插其中）；等待超过 heartbeat 秒时产出 None，供调用方发送心跳
+        # snapshot 在订阅时调用一次，返回的瞬时事件排在此前已发布的事件之后，用于补齐错过的瞬时事件
+        index = start
+        pending = deque(maxlen=TRANSIENT_BUFFER)
+        if snapshot is not None:
+            event = snapshot()
+            if event is not None:
+                pending.append((len(self.events), {"id": None, **event}))
+        self._listeners.append(pending)
+        try:
+            while True:
+                while index < len(self.events) or pending:
+                    if pending and (pending[0][0] <= index or index >= len(self.events)):
+                        yield pending.popleft()[1]
+                    else:
+                        yield self.events[index]
+                        index += 1
+                if self.closed:
+                    return
+                waiter = self._waiter
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self._listeners.remove(pending)
@@ -0,0 +1,267 @@
+import asyncio
+import ipaddress
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from html import unescape
+from html.parser import HTMLParser
+from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit
+
+from config import (
+    FETCH_MAX_CONCURRENCY,
+    FETCH_PER_DOMAIN_LIMIT,
+    FETCH_TIMEOUT,
+    FETCH_MAX_BYTES,
+    PAGE_STORE_PATH,
+    PAGE_STORE_TTL,
+    PAGE_STORE_MAX_ENTRIES,
+    FETCH_ALLOW_PRIVATE_HOSTS,
+)
+from http_client import HttpClient
+from tracing import span
+
+try:
+    import trafilatura
+except ImportError:
+    trafilatura = None
+
+# 这些标签内的内容视为模板/导航噪声，整体丢弃
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe", "button", "select"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "br", "tr", "dd", "dt"}
+MIN_BLOCK_CHARS = 25
+MAX_LINK_DENSITY = 0.5
+
+
+class _MainTextParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._skip_depth = 0
+        self._in_link = 0
+        self._text = []
+        self._link_chars = 0
+
+    def _flush(self):
+        text = re.sub(r"\s+", " ", "".join(self._text)).strip()
+        if len(text) >= MIN_BLOCK_CHARS and self._link_chars / max(len(text), 1) <= MAX_LINK_DENSITY:
+            self.blocks.append(text)
+        self._text = []
+        self._link_chars = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "a":
+            self._in_link += 1
+        if tag in BLOCK_TAGS and not self._skip_depth:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "a" and self._in_link:
+            self._in_link -= 1
+        if tag in BLOCK_TAGS and not self._skip_depth:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._text.append(data)
+        if self._in_link:
+            self._link_chars += len(data.strip())
+
+
+def extract_main_text(html: str) -> Dict[str, str]:
+    # 优先使用 trafilatura；未安装时退回基于块长度与链接密度的简易去模板算法
+    match = re.search(r"<title[^>]*>(.*?)</title>", html, re.I | re.S)
+    title = unescape(re.sub(r"\s+", " ", match.group(1))).strip() if match else ""
+    if trafilatura is not None:
+        text = trafilatura.extract(html, include_comments=False, include_tables=False)
+        if text:
+            return {"title": title, "text": text.strip()}
+    parser = _MainTextParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    parser._flush()
+    return {"title": title, "text": "\n".join(parser.blocks)}
+
+
+def _decode(body: bytes, charset: Optional[str]) -> str:
+    if not charset:
+        match = re.search(rb"<meta[^>]+charset=[\"']?([\w-]+)", body[:4096], re.I)
+        charset = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+class UnsafeURLError(ValueError):
+    """链接不是 http(s)，或主机解析到内网、回环等非公网地址。"""
+
+
+def _is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.split("%", 1)[0])
+        return True
+    except ValueError:
+        return False
+
+
+def _is_public_ip(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_public_address(host: str, address: str):
+    # 建立连接前对实际要连接的地址再校验一次，见 http_client.PinnedNetworkBackend
+    if not _is_public_ip(address):
+        raise UnsafeURLError(f"non-public address: {host} -> {address}")
+
+
+async def check_public_url(url: str):
+    # 搜索结果中的链接不可信：只允许 http(s)，且主机的所有解析地址都必须是公网地址。
+    # 这里在请求前尽早拒绝；连接时的解析结果可能不同（DNS rebinding），由 check_public_address 在连接时兜底
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeURLError(f"unsupported url: {url}")
+    try:
+        addresses = [parts.hostname] if _is_ip_literal(parts.hostname) else [
+            info[4][0] for info in await asyncio.get_running_loop().getaddrinfo(
+                parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), type=socket.SOCK_STREAM)
+        ]
+    except socket.gaierror as e:
+        raise UnsafeURLError(f"cannot resolve {parts.hostname}: {e}") from e
+    if not addresses or not all(_is_public_ip(a) for a in addresses):
+        raise UnsafeURLError(f"non-public address: {parts.hostname}")
+
+
+class PageStore:
+    """抽取后网页正文的 SQLite 存储，按 URL 建键；写入时清理过期条目，超过 max_entries 时删除最早抓取的页面。"""
+
+    def __init__(self, path=PAGE_STORE_PATH, ttl=PAGE_STORE_TTL, max_entries=PAGE_STORE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                text TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                truncated INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_fetched_at ON pages (fetched_at)")
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, text, bytes, truncated, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or time.time() - row[4] > self.ttl:
+            return None
+        return {"url": url, "title": row[0], "text": row[1], "bytes": row[2], "truncated": bool(row[3]), "cached": True, "error": None}
+
+    def put(self, page: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, title, text, bytes, truncated, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (page["url"], page.get("title", ""), page["text"], page.get("bytes", 0), int(page.get("truncated", False)), now),
+            )
+            removed = self._conn.execute("DELETE FROM pages WHERE fetched_at < ?", (now - self.ttl,)).rowcount
+            count = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY fetched_at ASC LIMIT ?)", (overflow,)
+                ).rowcount
+            self.evictions += removed
+            self._conn.commit()
+
+
+class PageFetcher:
+    """并发抓取网页并抽取正文：全局并发上限 + 单域名并发上限 + 流式大小上限 + 总超时。"""
+
+    def __init__(self, max_concurrency=FETCH_MAX_CONCURRENCY, per_domain_limit=FETCH_PER_DOMAIN_LIMIT,
+                 timeout=FETCH_TIMEOUT, max_bytes=FETCH_MAX_BYTES, store: PageStore = None,
+                 allow_private_hosts=FETCH_ALLOW_PRIVATE_HOSTS, transport=None):
+        self.client = HttpClient(timeout=timeout, per_host_limit=per_domain_limit, transport=transport,
+                                 check_address=None if allow_private_hosts else check_public_address)
+        self.allow_private_hosts = allow_private_hosts
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.store = store or PageStore()
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def fetch(self, url: str) -> Dict[str, Any]:
+        with span("fetch", "fetch", url=url) as attrs:
+            page = await self._fetch(url)
+            attrs.update(cache_hit=page["cached"], bytes=page["bytes"], text_chars=len(page["text"]), failed=page["error"] is not None)
+            return page
+
+    async def _fetch(self, url: str) -> Dict[str, Any]:
+        cached = await asyncio.to_thread(self.store.get, url)
+        if cached is not None:
+            return cached
+        page = {"url": url, "title": "", "text": "", "bytes": 0, "truncated": False, "cached": False, "error": None}
+        try:
+            async with self._semaphore():
+                content_type, charset, body, truncated = await asyncio.wait_for(
+                    self.client.get_capped(url, self.max_bytes, content_types=("html", "xml", "text/plain"),
+                                           check_url=None if self.allow_private_hosts else check_public_url),
+                    timeout=self.timeout,
+                )
+        except Exception as e:
+            page["error"] = f"{type(e).__name__}: {e}"
+            return page
+        page["bytes"] = len(body)
+        page["truncated"] = truncated
+        if not body:
+            page["error"] = f"unsupported content type: {content_type}"
+            return page
+        html = _decode(body, charset)
+        if "text/plain" in content_type:
+            extracted = {"title": "", "text": html.strip()}
+        else:
+            # 正文抽取是 CPU 密集操作，放到线程中执行，避免阻塞事件循环
+            extracted = await asyncio.to_thread(extract_main_text, html)
+        page.update(extracted)
+        if page["text"]:
+            await asyncio.to_thread(self.store.put, page)
+        return page
+
+    async def fetch_many(self, urls: List[str]) -> List[Dict[str, Any]]:
+        unique_urls = list(dict.fromkeys(u for u in urls if u and urlsplit(u).scheme in ("http", "https")))
+        return await asyncio.gather(*(self.fetch(u) for u in unique_urls))
+
+
+page_fetcher = PageFetcher()
@@ -1,6 +1,16 @@
-from langgraph.graph import StateGraph, END
+import os
+from contextlib import asynccontextmanager
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Send
+from langgraph.checkpoint.memory import MemorySaver
+try:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except ImportError:
+    AsyncSqliteSaver = None
+from config import CHECKPOINT_ENABLED, CHECKPOINT_PATH, NOVELTY_THRESHOLD
 from research_state import ResearchState
 from nodes import planner_node, researcher_node, synthesizer_node, final_report_node
+from budget import metered, budget_exhausted
 
 # --- 定义条件边 ---
 def should_continue(state: ResearchState) -> str:
@@ -17,22 +27,62 @@ def should_continue(state: ResearchState) -> str:
     if current_iteration >= max_iterations:
         print(f"条件判断: 达到最大迭代次数 ({max_iterations})，流程转向 final_report_generator")
         return "generate_report"
+    budget_reason = budget_exhausted(state)
+    if budget_reason:
+        print(f"条件判断: {budget_reason}，流程转向 final_report_generator")
+        return "generate_report"
+    if state.get("converged"):
+        print(f"条件判断: 边际新颖度低于阈值 ({NOVELTY_THRESHOLD})，研究已收敛，流程转向 final_report_generator")
+        return "generate_report"
 
     print("条件判断: 继续研究，流程转向 planner")
     return "continue_research"
 
+# 并行分发：planner 给出子问题时，为每个子问题派发一个 researcher 实例，
+# 各实例的研究结果经 research_history 的 add_messages 归并后再进入 synthesizer
+def dispatch_research(state: ResearchState):
+    sub_tasks = state.get("sub_tasks") or []
+    if state.get("fan_out") and sub_tasks and state.get("current_task") != "FINAL_REPORT_TASK":
+        print(f"并行分发: {len(sub_tasks)} 个子问题")
+        return [Send("researcher", {**state, "sub_task": sub_task}) for sub_task in sub_tasks]
+    return "researcher"
+
+# 入口：带已确认计划（warm start）的研究直接按计划派发 researcher，否则先由 planner 生成任务
+def route_entry(state: ResearchState):
+    if state.get("warm_start") and state.get("current_task"):
+        print("入口: 使用已确认的研究计划，跳过 planner")
+        return dispatch_research(state)
+    return "planner"
+
+# --- 检查点存储 ---
+# 每个节点完成后的状态按 thread_id（即 run_id）写入检查点，研究中断后可从最后完成的节点恢复
+@asynccontextmanager
+async def open_checkpointer(path=CHECKPOINT_PATH):
+    if not CHECKPOINT_ENABLED:
+        yield None
+        return
+    if AsyncSqliteSaver is None:
+        print("检查点: 未安装 langgraph-checkpoint-sqlite，改用内存检查点（仅能恢复本进程内中断的研究）")
+        yield MemorySaver()
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    async with AsyncSqliteSaver.from_conn_string(path) as checkpointer:
+        yield checkpointer
+
 # --- 构建工作流 ---
-def build_research_graph():
+def build_research_graph(checkpointer=None):
     workflow = StateGraph(ResearchState)
 
-    workflow.add_node("planner", planner_node)
-    workflow.add_node("researcher", researcher_node)
-    workflow.add_node("synthesizer", synthesizer_node)
-    workflow.add_node("final_report_generator", final_report_node)
+    # 每个节点记录自身的 token 用量与耗时，供预算判断与进度展示
+    workflow.add_node("planner", metered("planner", planner_node))
+    workflow.add_node("researcher", metered("researcher", researcher_node))
+    workflow.add_node("synthesizer", metered("synthesizer", synthesizer_node))
+    workflow.add_node("final_report_generator", metered("final_report_generator", final_report_node))
 
-    workflow.set_entry_point("planner")
+    workflow.add_conditional_edges(START, route_entry, ["planner", "researcher"])
 
-    workflow.add_edge("planner", "researcher")
+    workflow.add_conditional_edges("planner", dispatch_research, ["researcher"])
     workflow.add_edge("researcher", "synthesizer")
 
     workflow.add_conditional_edges(
@@ -42,4 +92,4 @@ def build_research_graph():
     )
     workflow.add_edge("final_report_generator", END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
@@ -0,0 +1,144 @@
+import asyncio
+import importlib.util
+import socket
+from typing import Callable, Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import httpcore
+import httpx
+
+from config import SEARCH_TIMEOUT, SEARCH_MAX_CONNECTIONS, SEARCH_MAX_KEEPALIVE, SEARCH_PER_HOST_LIMIT
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+}
+
+# 安装了 h2 时启用 HTTP/2，否则退回 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """建立连接时自行解析主机名，逐个校验解析出的地址后直接连接该 IP。
+
+    校验与连接使用同一次解析结果，连接时不会再解析一次，避免 DNS rebinding 绕过校验；
+    TLS 的 SNI 与证书校验仍使用原主机名（由 httpcore 在 start_tls 时传入）。
+    """
+
+    def __init__(self, check_address: Callable[[str, str], None], backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self.check_address = check_address
+        self.backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise httpcore.ConnectError(f"cannot resolve {host}: {e}") from e
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        for address in addresses:
+            self.check_address(host, address)
+        last_error = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+            except httpcore.ConnectError as e:
+                last_error = e
+        raise last_error or httpcore.ConnectError(f"cannot resolve {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+class HttpClient:
+    """共享连接池的异步 HTTP 客户端，供 SearXNG 搜索与网页抓取使用。
+
+    httpx.AsyncClient 绑定在创建它的事件循环上，因此每个事件循环各持有一个客户端；
+    单个主机的并发数由信号量限制，避免把某个实例打爆。transport 可替换为本地替身（如 httpx.MockTransport）用于测试。
+    传入 check_address(host, address) 时每个连接都经 PinnedNetworkBackend 校验并固定到校验过的地址（替换 transport 时不生效）。
+    """
+
+    def __init__(self, timeout=SEARCH_TIMEOUT, max_connections=SEARCH_MAX_CONNECTIONS,
+                 max_keepalive=SEARCH_MAX_KEEPALIVE, per_host_limit=SEARCH_PER_HOST_LIMIT, transport=None,
+                 check_address: Optional[Callable[[str, str], None]] = None):
+        self.timeout = timeout
+        self.transport = transport
+        self.check_address = check_address
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.per_host_limit = per_host_limit
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._host_semaphores: Dict[tuple, asyncio.Semaphore] = {}
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=self.limits,
+                timeout=self.timeout,
+                headers=DEFAULT_HEADERS,
+                follow_redirects=True,
+                transport=self.transport or self._pinned_transport(),
+            )
+            self._clients[loop] = client
+        return client
+
+    def _pinned_transport(self) -> Optional[httpx.AsyncHTTPTransport]:
+        # 每个事件循环的客户端各用一个 transport（关闭客户端时会一并关闭）；httpx 未公开 network_backend 参数，直接替换连接池的后端
+        if self.check_address is None:
+            return None
+        transport = httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, limits=self.limits)
+        transport._pool._network_backend = PinnedNetworkBackend(self.check_address)
+        return transport
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        key = (asyncio.get_running_loop(), urlsplit(url).netloc)
+        semaphore = self._host_semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self._host_semaphores[key] = semaphore
+        return semaphore
+
+    async def get_json(self, url: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        async with self._host_semaphore(url):
+            resp = await self._client().get(url, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_capped(self, url: str, max_bytes: int, content_types=None, check_url=None, max_redirects: int = 5):
+        # 流式读取响应体，超过 max_bytes 立即停止；content_types 不匹配时不读取响应体
+        # 传入 check_url 时手动跟随重定向，每一跳请求前都由 check_url 校验（不通过时抛出异常）
+        async with self._host_semaphore(url):
+            for _ in range(max_redirects + 1):
+                if check_url is not None:
+                    await check_url(url)
+                async with self._client().stream("GET", url, follow_redirects=check_url is None) as resp:
+                    if check_url is not None and resp.is_redirect:
+                        url = str(resp.url.join(resp.headers["location"]))
+                        continue
+                    resp.raise_for_status()
+                    content_type = resp.headers.get("content-type", "")
+                    if content_types and not any(t in content_type for t in content_types):
+                        return content_type, resp.charset_encoding, b"", False
+                    chunks = []
+                    size = 0
+                    truncated = False
+                    async for chunk in resp.aiter_bytes():
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size >= max_bytes:
+                            truncated = True
+                            break
+                    return content_type, resp.charset_encoding, b"".join(chunks)[:max_bytes], truncated
+            raise httpx.TooManyRedirects(f"Exceeded maximum allowed redirects: {max_redirects}")
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+        for key in [k for k in self._host_semaphores if k[0] is loop]:
+            del self._host_semaphores[key]
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional
+
+from browser_use.llm.views import ChatInvokeCompletion
+
+from llm_stream import astream_completion
+from token_utils import record_llm_usage, llm_payload
+from tracing import span, begin_span, end_span
+
+# 为 True 时跳过缓存读取（结果仍写回缓存），由 bypass_llm_cache 设置
+_bypass_cache: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+# 参与缓存键计算的采样参数（模型对象上存在时才计入）
+CACHE_KEY_PARAMS = (
+    "temperature",
+    "top_p",
+    "top_k",
+    "max_tokens",
+    "max_output_tokens",
+    "seed",
+    "frequency_penalty",
+    "presence_penalty",
+)
+
+
+@contextmanager
+def bypass_llm_cache(enabled: bool = True):
+    """在该上下文（及其创建的任务）中的 LLM 调用不读缓存，重新生成并刷新缓存条目，如 /plan 的 force_refresh。"""
+    token = _bypass_cache.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass_cache.reset(token)
+
+
+def _serialize_message(message) -> Dict[str, Any]:
+    if hasattr(message, "model_dump"):
+        return message.model_dump(mode="json")
+    return {"role": getattr(message, "role", type(message).__name__), "content": str(getattr(message, "content", message))}
+
+
+class CachedChatModel:
+    """对 browser_use 聊天模型的内容寻址缓存包装。
+
+    缓存键 = 模型名 + 采样参数 + 提示消息的 SHA-256，结果持久化到 SQLite，仅做精确匹配。
+    zero_temperature_only=True 时，只有温度显式为 0 的模型才会读写缓存。
+    条目超过 ttl 秒即失效，总数超过 max_entries 时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, llm, path: str, enabled: bool = True, zero_temperature_only: bool = False,
+                 ttl: float = 7 * 24 * 3600, max_entries: int = 20000):
+        self.llm = llm
+        self.path = path
+        self.enabled = enabled
+        self.zero_temperature_only = zero_temperature_only
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                completion TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL DEFAULT 0
+            )"""
+        )
+        # 旧版本创建的表没有 last_access 列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+        if "last_access" not in columns:
+            self._conn.execute("ALTER TABLE llm_cache ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE llm_cache SET last_access = created_at")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        # 未包装的属性（model、provider、name 等）透传给底层模型
+        return getattr(self.llm, name)
+
+    @property
+    def model_name(self) -> str:
+        return str(getattr(self.llm, "model", None) or getattr(self.llm, "name", type(self.llm).__name__))
+
+    def params(self) -> Dict[str, Any]:
+        return {name: getattr(self.llm, name) for name in CACHE_KEY_PARAMS if getattr(self.llm, name, None) is not None}
+
+    def cacheable(self) -> bool:
+        if not self.enabled:
+            return False
+        if self.zero_temperature_only:
+            return self.params().get("temperature") == 0
+        return True
+
+    def make_key(self, messages: List[Any]) -> str:
+        payload = {
+            "provider": getattr(self.llm, "provider", ""),
+            "model": self.model_name,
+            "params": self.params(),
+            "messages": [_serialize_message(m) for m in messages],
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT completion, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0]
+
+    def store(self, key: str, completion: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, completion, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, self.model_name, completion, now, now),
+            )
+            # 同一数据库由多个模型包装共享，淘汰按整张表计算
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        if _bypass_cache.get():
+            self.bypassed += 1
+            return None
+        return await asyncio.to_thread(self.lookup, key)
+
+    async def ainvoke(self, messages: List[Any], output_format=None, **kwargs):
+        with span("llm", "llm", model=self.model_name, cache_hit=False) as attrs:
+            # 结构化输出不缓存，直接交给底层模型
+            if output_format is not None or not self.cacheable():
+                self.skipped += 1
+                response = await self.llm.ainvoke(messages, output_format, **kwargs)
+                record_llm_usage(messages, getattr(response, "completion", ""), getattr(response, "usage", None))
+                attrs.update(llm_payload(messages, str(getattr(response, "completion", "")), getattr(response, "usage", None)))
+                return response
+            key = self.make_key(messages)
+            completion = await self._lookup(key)
+            if completion is not None:
+                self.hits += 1
+                attrs.update(cache_hit=True, **llm_payload(messages, completion))
+                return ChatInvokeCompletion(completion=completion, usage=None)
+            self.misses += 1
+            response = await self.llm.ainvoke(messages, **kwargs)
+            record_llm_usage(messages, getattr(response, "completion", ""), getattr(response, "usage", None))
+            attrs.update(llm_payload(messages, str(getattr(response, "completion", "")), getattr(response, "usage", None)))
+            if isinstance(getattr(response, "completion", None), str):
+                await asyncio.to_thread(self.store, key, response.completion)
+            return response
+
+    async def astream(self, messages: List[Any]):
+        # 命中缓存时整段产出；未命中时流式转发底层模型输出，结束后写入缓存
+        record = begin_span("llm", "llm", model=self.model_name, cache_hit=False, stream=True)
+        parts = []
+        error = None
+        try:
+            if not self.cacheable():
+                self.skipped += 1
+                async for delta in astream_completion(self.llm, messages):
+                    parts.append(delta)
+                    yield delta
+                record_llm_usage(messages, "".join(parts))
+                return
+            key = self.make_key(messages)
+            completion = await self._lookup(key)
+            if completion is not None:
+                self.hits += 1
+                parts.append(completion)
+                if record is not None:
+                    record["attrs"]["cache_hit"] = True
+                yield completion
+                return
+            self.misses += 1
+            async for delta in astream_completion(self.llm, messages):
+                parts.append(delta)
+                yield delta
+            record_llm_usage(messages, "".join(parts))
+            await asyncio.to_thread(self.store, key, "".join(parts))
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            end_span(record, error=error, **llm_payload(messages, "".join(parts)))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "enabled": self.enabled,
+            "zero_temperature_only": self.zero_temperature_only,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "bypassed": self.bypassed,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,278 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Dict, List, Any, Optional
+
+from llm_stream import astream_completion
+from token_utils import llm_payload
+from tracing import annotate_span
+
+# 当前调用的截止时间（time.monotonic()），由模型路由设置；重试等待会超过截止时间时不再重试
+_call_deadline: ContextVar[Optional[float]] = ContextVar("llm_call_deadline", default=None)
+
+# 视为瞬时错误、值得重试的 HTTP 状态码
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def set_call_deadline(timeout: Optional[float]) -> Token:
+    return _call_deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def reset_call_deadline(token: Token):
+    _call_deadline.reset(token)
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    # httpx 的连接/读取错误等网络层异常
+    return type(error).__module__.startswith(("httpx", "httpcore")) or isinstance(error, OSError)
+
+
+class AdaptiveLimiter:
+    """按观测延迟自适应的并发上限（AIMD）。
+
+    负载信号与请求形态无关：流式调用取首个输出之后每个输出 token 的解码时间；非流式调用按提示与输出 token 数
+    （半个倍频程一档）分桶，同一桶内比较总延迟。信号超过同类请求近期最小值的 tolerance 倍或出现瞬时错误时，
+    上限乘以 backoff_ratio（冷却期内最多下调一次）；请求占满上限且延迟正常时，上限每轮加 1（每次完成加 1/limit）。
+    """
+
+    def __init__(self, name: str, min_limit: int, max_limit: int, initial_limit: int,
+                 latency_tolerance: float, backoff_ratio: float, decrease_cooldown: float, window: int = 50):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit)
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.window = window
+        # 各类请求（解码 / 非流式的 token 数分桶）的近期信号样本
+        self.samples: Dict[tuple, deque] = {}
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self.acquired = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        self.acquired += 1
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已分到名额但调用方被取消，归还名额
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            self.total_wait += time.monotonic() - start
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @staticmethod
+    def _bucket(tokens: int) -> int:
+        return round(math.log2(max(tokens, 1)) * 2)
+
+    def on_success(self, latency: float, prompt_tokens: int, completion_tokens: int, saturated: bool,
+                   decode_time: Optional[float] = None):
+        # decode_time 为流式调用从首个输出到结束的时间；提示长、输出短的调用与输出长的调用每 token 延迟本就不同，不能共用基线
+        if decode_time is not None and completion_tokens > 1:
+            key, signal = ("decode",), decode_time / (completion_tokens - 1)
+        else:
+            key, signal = (self._bucket(prompt_tokens), self._bucket(completion_tokens)), latency
+        samples = self.samples.get(key)
+        if samples is None:
+            samples = self.samples[key] = deque(maxlen=self.window)
+        baseline = min(samples) if samples else None
+        samples.append(signal)
+        if baseline is not None and len(samples) >= 5 and signal > baseline * self.latency_tolerance:
+            self.decrease()
+        elif saturated and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+            self._wake()
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+        self.decreases += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "acquired": self.acquired,
+            "avg_wait": round(self.total_wait / self.acquired, 3) if self.acquired else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class LLMGateway:
+    """所有 LLM 调用共享的网关：每个后端（同一服务地址）一个自适应并发限制器，瞬时错误按抖动指数退避重试。"""
+
+    def __init__(self, min_concurrency=1, max_concurrency=8, initial_concurrency=2, latency_tolerance=2.0,
+                 backoff_ratio=0.7, decrease_cooldown=5.0, retries=2, retry_base_delay=0.5, retry_max_delay=8.0):
+        self.limiter_options = {
+            "min_limit": min_concurrency,
+            "max_limit": max_concurrency,
+            "initial_limit": initial_concurrency,
+            "latency_tolerance": latency_tolerance,
+            "backoff_ratio": backoff_ratio,
+            "decrease_cooldown": decrease_cooldown,
+        }
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._backends: Dict[str, Dict[str, int]] = {}
+
+    def limiter(self, backend: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(backend)
+        if limiter is None:
+            limiter = self._limiters[backend] = AdaptiveLimiter(backend, **self.limiter_options)
+            self._backends[backend] = {"calls": 0, "retries": 0, "transient_errors": 0, "errors": 0}
+        return limiter
+
+    def retry_delay(self, attempt: int) -> Optional[float]:
+        # 全抖动指数退避；超过本次调用的截止时间时返回 None，不再重试
+        if attempt >= self.retries:
+            return None
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        deadline = _call_deadline.get()
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _on_error(self, backend: str, limiter: AdaptiveLimiter, error: Exception, attempt: int) -> Optional[float]:
+        counters = self._backends[backend]
+        if not is_transient(error):
+            counters["errors"] += 1
+            return None
+        counters["transient_errors"] += 1
+        limiter.decrease()
+        delay = self.retry_delay(attempt)
+        if delay is not None:
+            counters["retries"] += 1
+            print(f"LLM 网关 {backend}: {type(error).__name__}: {error}，{delay:.2f} 秒后第 {attempt + 1} 次重试")
+        return delay
+
+    async def ainvoke(self, backend: str, llm, messages: List[Any], output_format=None, **kwargs):
+        limiter = self.limiter(backend)
+        self._backends[backend]["calls"] += 1
+        attempt = 0
+        queue_wait = 0.0
+        while True:
+            wait_start = time.monotonic()
+            await limiter.acquire()
+            start = time.monotonic()
+            queue_wait += start - wait_start
+            saturated = limiter.in_flight >= int(limiter.limit)
+            try:
+                response = await llm.ainvoke(messages, output_format, **kwargs)
+            except Exception as e:
+                delay = self._on_error(backend, limiter, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                payload = llm_payload(messages, str(getattr(response, "completion", "")), getattr(response, "usage", None))
+                limiter.on_success(time.monotonic() - start, payload["prompt_tokens"], payload["completion_tokens"], saturated)
+                # 记录到当前 LLM span：等待并发名额的时间与尝试次数
+                annotate_span(backend=backend, queue_wait=round(queue_wait, 3), attempts=attempt + 1)
+                return response
+            finally:
+                limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def astream(self, backend: str, llm, messages: List[Any]):
+        # 流式调用：仅在尚未产出任何内容时重试，已产出部分输出后出错直接抛出
+        limiter = self.limiter(backend)
+        self._backends[backend]["calls"] += 1
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            saturated = limiter.in_flight >= int(limiter.limit)
+            start = time.monotonic()
+            first_output = None
+            parts = []
+            delay = None
+            try:
+                async for delta in astream_completion(llm, messages):
+                    if first_output is None:
+                        first_output = time.monotonic()
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                delay = None if parts else self._on_error(backend, limiter, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                end = time.monotonic()
+                payload = llm_payload(messages, "".join(parts))
+                limiter.on_success(end - start, payload["prompt_tokens"], payload["completion_tokens"], saturated,
+                                   decode_time=end - first_output if first_output is not None else None)
+                return
+            finally:
+                limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {backend: {**limiter.stats(), **self._backends[backend]} for backend, limiter in self._limiters.items()}
+
+
+class GatedChatModel:
+    """让聊天模型的调用经过 LLMGateway：并发受所在后端的自适应上限约束，瞬时错误自动重试。"""
+
+    def __init__(self, llm, gateway: LLMGateway):
+        self.llm = llm
+        self.gateway = gateway
+        self.backend = f"{getattr(llm, 'provider', type(llm).__name__)}:{getattr(llm, 'host', None) or 'default'}"
+
+    def __getattr__(self, name):
+        # 未包装的属性（model、provider、name 等）透传给底层模型
+        return getattr(self.llm, name)
+
+    async def ainvoke(self, messages: List[Any], output_format=None, **kwargs):
+        return await self.gateway.ainvoke(self.backend, self.llm, messages, output_format, **kwargs)
+
+    async def astream(self, messages: List[Any]):
+        async for delta in self.gateway.astream(self.backend, self.llm, messages):
+            yield delta
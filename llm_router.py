@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List, Any, Optional
+
+from config import MODEL_ROUTES
+from llm_gateway import set_call_deadline, reset_call_deadline
+from llm_stream import astream_completion
+from token_utils import current_usage
+
+
+def _model_label(model) -> str:
+    return str(getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__)
+
+
+class ModelRoute:
+    """单个节点的模型路由：独立的模型回退链、并发上限与单次调用超时。
+
+    模型链中的模型依次尝试，调用失败或超时即回退到下一个；全部失败时抛出最后一个异常。
+    """
+
+    def __init__(self, name: str, models: List[Any], max_concurrency: int = 4, timeout: Optional[float] = None):
+        if not models:
+            raise ValueError(f"模型路由 {name} 未配置任何模型")
+        self.name = name
+        self.models = models
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self.latencies = deque(maxlen=100)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.tokens = 0
+        self.in_flight = 0
+        self.model_calls: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _on_error(self, model, error: Exception, position: int):
+        if isinstance(error, asyncio.TimeoutError):
+            self.timeouts += 1
+        self.last_error = f"{_model_label(model)}: {type(error).__name__}: {error}"
+        if position < len(self.models) - 1:
+            self.fallbacks += 1
+            print(f"模型路由 {self.name}: {self.last_error}，回退到 {_model_label(self.models[position + 1])}")
+
+    def _on_success(self, model, start: float, usage_before: Optional[int]):
+        label = _model_label(model)
+        self.model_calls[label] = self.model_calls.get(label, 0) + 1
+        self.latencies.append(time.monotonic() - start)
+        meter = current_usage()
+        if meter is not None and usage_before is not None:
+            self.tokens += meter["tokens"] - usage_before
+
+    async def ainvoke(self, messages: List[Any], output_format=None, **kwargs):
+        self.calls += 1
+        async with self._semaphore():
+            self.in_flight += 1
+            try:
+                for position, model in enumerate(self.models):
+                    start = time.monotonic()
+                    meter = current_usage()
+                    usage_before = meter["tokens"] if meter is not None else None
+                    # 超时即本次调用的截止时间，网关据此判断是否还来得及重试
+                    deadline_token = set_call_deadline(self.timeout)
+                    try:
+                        response = await asyncio.wait_for(model.ainvoke(messages, output_format, **kwargs), timeout=self.timeout)
+                    except Exception as e:
+                        self._on_error(model, e, position)
+                        if position == len(self.models) - 1:
+                            self.failures += 1
+                            raise
+                        continue
+                    finally:
+                        reset_call_deadline(deadline_token)
+                    self._on_success(model, start, usage_before)
+                    return response
+            finally:
+                self.in_flight -= 1
+
+    async def astream(self, messages: List[Any]):
+        # 流式调用：超时按相邻两段输出的间隔计；只有尚未产出任何内容时才回退到下一个模型
+        self.calls += 1
+        async with self._semaphore():
+            self.in_flight += 1
+            try:
+                for position, model in enumerate(self.models):
+                    start = time.monotonic()
+                    meter = current_usage()
+                    usage_before = meter["tokens"] if meter is not None else None
+                    stream = astream_completion(model, messages)
+                    produced = False
+                    try:
+                        while True:
+                            try:
+                                delta = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            produced = True
+                            yield delta
+                    except Exception as e:
+                        self._on_error(model, e, position)
+                        if produced or position == len(self.models) - 1:
+                            self.failures += 1
+                            raise
+                        continue
+                    finally:
+                        await stream.aclose()
+                    self._on_success(model, start, usage_before)
+                    return
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        return {
+            "models": [_model_label(m) for m in self.models],
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "model_calls": self.model_calls,
+            "tokens": self.tokens,
+            "avg_latency": round(sum(ordered) / len(ordered), 3) if ordered else None,
+            "p95_latency": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    """按图节点名选择模型路由，未配置的节点使用 default 路由。"""
+
+    def __init__(self, routes: Dict[str, Dict[str, Any]]):
+        self.routes = {name: ModelRoute(name, **options) for name, options in routes.items()}
+
+    def route(self, node_name: str) -> ModelRoute:
+        return self.routes.get(node_name) or self.routes["default"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: route.stats() for name, route in self.routes.items()}
+
+
+model_router = ModelRouter(MODEL_ROUTES)
@@ -0,0 +1,30 @@
+from typing import Any, AsyncIterator, List
+
+
+async def astream_completion(llm, messages: List[Any]) -> AsyncIterator[str]:
+    """逐段产出模型输出文本。
+
+    模型自身支持流式（带 astream 方法，如 CachedChatModel）时直接使用；Ollama 模型通过其
+    AsyncClient 的流式接口逐 token 读取；其他模型退回一次性 ainvoke，整段产出。
+    """
+    if hasattr(type(llm), "astream"):
+        async for delta in llm.astream(messages):
+            yield delta
+        return
+    if getattr(llm, "provider", None) == "ollama" and hasattr(llm, "get_client"):
+        from browser_use.llm.ollama.serializer import OllamaMessageSerializer
+
+        stream = await llm.get_client().chat(
+            model=llm.model,
+            messages=OllamaMessageSerializer.serialize_messages(messages),
+            stream=True,
+        )
+        async for part in stream:
+            delta = part.message.content if part.message else ""
+            if delta:
+                yield delta
+        return
+    response = await llm.ainvoke(messages)
+    completion = response.completion if hasattr(response, "completion") else str(response)
+    if completion:
+        yield completion
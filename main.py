@@ -1,26 +1,219 @@
 import os
 import asyncio
+import hashlib
+import json
 import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from datetime import datetime
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 
-from graph import build_research_graph
+from graph import build_research_graph, open_checkpointer
+from budget import budget_usage, budget_exhausted
 from research_state import ResearchState
-from nodes import planner_node
+from nodes import planner_node, parse_sub_tasks, generate_search_queries
+from fetcher import page_fetcher
+from search import backend_pool, amulti_search
+from search_cache import search_cache, normalize_query
+from config import (LLM, LLM_GATEWAY, FANOUT_WIDTH, FANOUT_MAX_CONCURRENCY, RESEARCH_REUSE_TTL, RESEARCH_PROGRESS_MAX_COMPLETED,
+                    CHECKPOINT_KEEP_COMPLETED, EARLY_STOP_ENABLED, PLAN_WARM_START, PLAN_CACHE_TTL, PLAN_CACHE_MAX_ENTRIES,
+                    PLAN_SPECULATIVE_SEARCH, PLAN_SPECULATIVE_MAX_TASKS, FETCH_ENABLED, FETCH_TOP_K, FUSED_RESULTS, QUERY_REWRITE_COUNT, TRACE_STORE,
+                    METRICS_ENABLED, METRICS_LOOP_LAG_INTERVAL)
+from retrieval import release_run_index
+from prefetch import search_prefetcher
+from tracing import span
+import metrics
+from events import EventChannel
+from scheduler import research_scheduler, QueueFullError
+from report_store import report_store
+from llm_router import model_router
+from llm_cache import bypass_llm_cache
 
-# Compile the graph once at startup
-app_graph = build_research_graph()
+# Compile the graph once at startup（在 lifespan 中打开检查点存储后编译）
+app_graph = None
 
-# Dictionary to store ongoing and completed research progress
+# Dictionary to store ongoing and completed research progress, keyed by run_id
 research_progress = {}
-# Dictionary to store completed reports for retrieval
-completed_reports = {}
+# 已完成研究的 run_id（按完成顺序），超出上限时从内存中淘汰最早的进度，报告本身保存在 report_store
+completed_runs = deque()
+# 每个研究的进度事件通道，供 /research_stream 推送
+progress_channels = {}
+# 原始查询 -> 最近一次对应的 run_id，兼容按 query 查询的接口
+query_runs = {}
+# 相同研究（归一化查询 + 计划 + 参数）的在途合并与结果复用：合并键 -> run_id / (run_id, 完成时间)
+inflight_runs = {}
+reusable_runs = {}
+# /plan 结果缓存：(归一化查询, 分发参数) -> {计划, 生成时间, 预取任务, 预取时改写出的查询}，按 LRU 淘汰
+plan_cache = OrderedDict()
+# /plan 触发的后台预取搜索任务（保留引用，避免任务被回收；数量上限 PLAN_SPECULATIVE_MAX_TASKS）
+speculative_tasks = set()
+
+# SSE 心跳间隔（秒），防止代理因空闲断开连接
+STREAM_HEARTBEAT = 15
+
+def _coalesce_key(query, plan, max_iterations, fan_out, fanout_width, early_stop, time_budget, token_budget, warm_start,
+                  bypass_search_cache, force_refresh):
+    # 跳过缓存的研究只与同样跳过缓存的研究合并，避免要求新鲜结果的请求拿到读缓存得到的结果
+    raw = json.dumps([normalize_query(query), " ".join(plan.split()), max_iterations, fan_out, fanout_width, early_stop,
+                      time_budget, token_budget, warm_start, bypass_search_cache, force_refresh], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cached_plan(key):
+    entry = plan_cache.get(key)
+    if entry is None:
+        return None
+    if time.time() - entry["created_at"] > PLAN_CACHE_TTL:
+        del plan_cache[key]
+        return None
+    plan_cache.move_to_end(key)
+    return entry
+
+def _store_plan(key, plan):
+    entry = plan_cache[key] = {"plan": plan, "created_at": time.time(), "speculation": None, "queries": []}
+    plan_cache.move_to_end(key)
+    while len(plan_cache) > PLAN_CACHE_MAX_ENTRIES:
+        plan_cache.popitem(last=False)
+    return entry
+
+def _planned_queries(key, plan):
+    # 提交的计划与 /plan 缓存中的计划一致时，返回预取时改写出的查询，供第一轮 researcher 直接使用
+    entry = _cached_plan(key)
+    return list(entry["queries"]) if entry is not None and entry["plan"] == plan else []
+
+def _start_speculative_search(query, entry, sub_tasks):
+    # 用户审阅计划期间预取研究第一轮要用的搜索结果与网页正文，研究开始后直接命中缓存或合并到进行中的请求。
+    # 每个计划缓存条目只预取一次（搜索结果的缓存时间长于计划缓存），后台任务达到上限时不再预取
+    if entry["speculation"] is not None:
+        return
+    if len(speculative_tasks) >= PLAN_SPECULATIVE_MAX_TASKS:
+        print(f"预取搜索任务已达上限 {PLAN_SPECULATIVE_MAX_TASKS}，跳过本次预取")
+        return
+
+    async def speculate():
+        try:
+            queries = sub_tasks
+            if not queries:
+                # 改写出的查询随计划缓存保存，研究时原样交给 researcher，不依赖 LLM 缓存复现同样的改写结果
+                entry["queries"] = await generate_search_queries(entry["plan"], query)
+                queries = entry["queries"][:QUERY_REWRITE_COUNT]
+            results = await amulti_search(queries, limit=FUSED_RESULTS)
+            if FETCH_ENABLED and results:
+                await page_fetcher.fetch_many([item["url"] for item in results[:FETCH_TOP_K]])
+        except Exception as e:
+            print(f"预取搜索失败: {e}")
+
+    task = entry["speculation"] = asyncio.create_task(speculate())
+    speculative_tasks.add(task)
+    task.add_done_callback(speculative_tasks.discard)
+
+def _find_reusable_run(key):
+    # 在新鲜度窗口内成功完成的相同研究可直接复用
+    entry = reusable_runs.get(key)
+    if entry is None:
+        return None
+    run_id, finished_at = entry
+    if time.time() - finished_at > RESEARCH_REUSE_TTL or run_id not in research_progress:
+        del reusable_runs[key]
+        return None
+    return run_id
+
+def _resolve_run_id(query=None, run_id=None):
+    if run_id:
+        return run_id
+    return query_runs.get(query)
+
+def _evict_completed_progress():
+    while len(completed_runs) > RESEARCH_PROGRESS_MAX_COMPLETED:
+        run_id = completed_runs.popleft()
+        research_progress.pop(run_id, None)
+        progress_channels.pop(run_id, None)
+        release_run_index(run_id)
+        for query in [q for q, r in query_runs.items() if r == run_id]:
+            del query_runs[query]
+
+def _stored_progress(report_data):
+    # 进度已从内存淘汰的研究，用存储中的报告拼出完成状态
+    return {
+        "run_id": report_data["run_id"],
+        "query": report_data["query"],
+        "progress": "研究执行期间发生错误: " + report_data["error"] if report_data["error"] else "研究完成，生成报告。",
+        "final_report": None if report_data["error"] else report_data["report"],
+        "logs": [],
+        "elapsed_time": report_data["elapsed_time"],
+        "is_complete": True,
+        "error": report_data["error"],
+    }
+
+def _track_budget(run_id, view, update):
+    # 跟踪预算判断所需的状态字段并刷新 token 用量；合成后若预算不足以再做一轮，记录提前结束的原因
+    view.update({k: v for k, v in update.items() if k != "node_costs"})
+    view["node_costs"].extend(update.get("node_costs") or [])
+    progress = research_progress[run_id]
+    progress["token_usage"] = budget_usage(view)
+    if "accumulated_findings" in update and not progress["budget_stop_reason"]:
+        progress["budget_stop_reason"] = budget_exhausted(view)
+
+def _progress_snapshot(run_id):
+    # 推送用的状态快照，不含日志列表与流式片段（二者分别以 log / token 事件推送）
+    return {k: v for k, v in research_progress[run_id].items() if k not in ("logs", "streaming")}
+
+def _publish_log(run_id, log_entry):
+    channel = progress_channels.get(run_id)
+    if channel is not None:
+        channel.publish("log", log_entry)
+
+def _refresh_queue_positions():
+    # 有研究出队时，其余排队中的研究位置随之前移，推送给对应的订阅者
+    for run_id, progress in research_progress.items():
+        if progress.get("queue_position") is not None and not progress["is_complete"]:
+            progress["queue_position"] = research_scheduler.position(run_id)
+            _publish_state(run_id)
+
+def _publish_state(run_id):
+    # 只在状态实际变化时推送，耗时字段的变化不单独触发
+    channel = progress_channels.get(run_id)
+    if channel is None:
+        return
+    snapshot = _progress_snapshot(run_id)
+    comparable = {k: v for k, v in snapshot.items() if k != "elapsed_time"}
+    if comparable == channel.last_state:
+        return
+    channel.last_state = comparable
+    channel.publish("state", snapshot)
+
+def _collect_service_metrics():
+    # /metrics 采集时刷新的状态类指标：调度队列、运行中的研究、LLM 网关各后端的并发状态、未使用的预取
+    scheduler_stats = research_scheduler.stats()
+    metrics.QUEUE_DEPTH.set(scheduler_stats["queue_depth"])
+    metrics.ACTIVE_RUNS.set(scheduler_stats["running"])
+    for backend, limiter in LLM_GATEWAY.stats().items():
+        metrics.LLM_GATEWAY_LIMIT.set(limiter["limit"], backend=backend)
+        metrics.LLM_GATEWAY_IN_FLIGHT.set(limiter["in_flight"], backend=backend)
+        metrics.LLM_GATEWAY_QUEUE_DEPTH.set(limiter["queue_depth"], backend=backend)
+    metrics.PREFETCH_PENDING.set(search_prefetcher.stats()["pending"])
 
 # --- FastAPI Web UI ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global app_graph
+    lag_monitor = None
+    if METRICS_ENABLED:
+        metrics.enable_span_metrics()
+        metrics.registry.add_collector(_collect_service_metrics)
+        lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag(METRICS_LOOP_LAG_INTERVAL))
+    try:
+        async with open_checkpointer() as checkpointer:
+            app_graph = build_research_graph(checkpointer)
+            yield
+    finally:
+        if lag_monitor is not None:
+            lag_monitor.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 # 新增 /plan 接口
 @app.post("/plan")
@@ -29,7 +222,16 @@ async def generate_plan(request: Request):
     query = data.get("query")
     if not query:
         return {"plan": "错误：未提供研究主题。"}
-    # 只调用 planner_node，生成 plan
+    fan_out = bool(data.get("fan_out", False))
+    fanout_width = int(data.get("fanout_width", FANOUT_WIDTH))
+    speculative = data.get("speculative_search", PLAN_SPECULATIVE_SEARCH)
+    plan_key = (normalize_query(query), fan_out, fanout_width)
+    cached = None if data.get("force_refresh") else _cached_plan(plan_key)
+    if cached is not None:
+        if speculative:
+            _start_speculative_search(query, cached, parse_sub_tasks(cached["plan"], fanout_width) if fan_out else [])
+        return {"plan": cached["plan"], "cached": True}
+    # 只调用 planner_node，生成 plan；fan_out 时计划末尾附带可并行检索的子问题
     state = {
         "initial_query": query,
         "current_task": "",
@@ -38,109 +240,319 @@ async def generate_plan(request: Request):
         "research_history": [],
         "accumulated_findings": "无初始发现。",
         "final_report": "",
+        "fan_out": fan_out,
+        "fanout_width": fanout_width,
     }
-    plan_result = await planner_node(state)
+    # force_refresh 时同时跳过 LLM 响应缓存，否则会重新得到缓存中相同的计划
+    with bypass_llm_cache(bool(data.get("force_refresh"))):
+        plan_result = await planner_node(state)
     plan_text = plan_result.get("current_task", "未能生成研究计划。")
+    if plan_result.get("current_task") not in (None, "", "FINAL_REPORT_TASK"):
+        entry = _store_plan(plan_key, plan_text)
+        if speculative:
+            _start_speculative_search(query, entry, plan_result.get("sub_tasks") or [])
     return {"plan": plan_text}
 
-# /research 接口，接收 plan，分步产出进度
-@app.post("/research")
-async def start_research(request: Request):
-    global research_progress
-    data = await request.json()
-    query = data.get("query")
-    plan = data.get("plan")
-    max_iterations = data.get("max_iterations", 3)
-    if not query or not plan:
-        return {"report": "错误：未提供研究主题或计划。"}
-    query_key = query
-    # 初始化进度
-    research_progress[query_key] = {
-        "progress": "研究已启动...",
+def _init_progress(run_id, query):
+    research_progress[run_id] = {
+        "run_id": run_id,
+        "query": query,
+        "coalesced_requests": 0,
+        "progress": "研究排队中...",
+        "queue_position": None,
         "final_report": None,
         "logs": [],
+        # 已用预算：总 token、耗时与按节点的用量；budget_stop_reason 为因预算不足提前生成报告的原因
         "token_usage": None,
+        "budget_stop_reason": None,
         "synthesizer_info": None,
+        "synthesis_tokens_saved": 0,
+        "dedup_tokens_saved": 0,
+        # 每轮合成后的边际新颖度，以及研究是否因收敛而提前结束
+        "novelty_scores": [],
+        "converged": False,
         "final_report_info": None,
+        # 正在流式生成的节点输出（节点完成后清除），供轮询客户端显示
+        "streaming": {},
         "start_time": time.time(),
         "elapsed_time": 0,
         "is_complete": False,
         "error": None,
+        # 出错后能否从检查点恢复（见 /research/{run_id}/resume）
+        "resumable": False,
     }
-    # 研究主流程
+    progress_channels[run_id] = EventChannel()
+    _publish_state(run_id)
+
+def _make_run(run_id, query, inputs, max_concurrency, coalesce_key=None, checkpoint_values=None, checkpoint_time=None):
+    # 返回交给调度器的研究主流程；inputs 为 None 时从该 run_id 的最后一个检查点（checkpoint_values，写入时间 checkpoint_time）继续执行
+    channel = progress_channels[run_id]
+
+    def on_token(node_name, delta):
+        streaming = research_progress[run_id]["streaming"]
+        streaming[node_name] = streaming.get(node_name, "") + delta
+        # token 事件不进入重放日志，重连时由 streaming 快照补齐
+        channel.publish("token", {"node": node_name, "delta": delta}, transient=True)
+
     async def run():
-        inputs: ResearchState = {
-            "initial_query": query,
-            "current_task": plan,
-            "max_iterations": max_iterations,
-            "current_iteration": 0,
-            "research_history": [],
-            "accumulated_findings": "无初始发现。",
-            "final_report": "",
-        }
+        research_progress[run_id]["progress"] = "研究已启动..." if inputs is not None else "研究从检查点恢复..."
+        research_progress[run_id]["queue_position"] = None
+        research_progress[run_id]["start_time"] = time.time()
+        _publish_state(run_id)
+        _refresh_queue_positions()
+        run_config = {"max_concurrency": max_concurrency, "configurable": {"thread_id": run_id, "on_token": on_token}}
+        if inputs is not None:
+            inputs["started_at"] = time.time()
+        budget_view = dict(inputs if inputs is not None else checkpoint_values or {})
+        # force_refresh 的研究整个图都不读 LLM 响应缓存（恢复时从检查点取该标记）
+        force_refresh = bool(budget_view.get("force_refresh"))
+        budget_view["node_costs"] = list(budget_view.get("node_costs") or [])
+        if inputs is None and checkpoint_time:
+            # 从最后一个检查点到本次开始执行之间的时间（出错、等待恢复与排队）不计入时间预算
+            paused_seconds = (budget_view.get("paused_seconds") or 0) + max(0.0, time.time() - checkpoint_time)
+            budget_view["paused_seconds"] = paused_seconds
+            run_config["configurable"]["paused_seconds"] = paused_seconds
         try:
-            async for output in app_graph.astream(inputs):
-                for key, value in output.items():
-                    if key != '__end__':
-                        log_entry_content = str(value)
-                        if len(log_entry_content) > 500:
-                            log_entry_content = log_entry_content[:500] + "..."
-                        # 结构化日志，带 step type
-                        log_entry = {"type": key, "content": log_entry_content}
-                        research_progress[query_key]["logs"].append(log_entry)
-                        print(f"Stream output: {log_entry}")
-                last_output_key = list(output.keys())[-1]
-                current_state = output.get('__end__') or output.get(last_output_key)
-                if current_state:
-                    if current_state.get('final_report'):
-                        research_progress[query_key]["progress"] = "研究完成，生成报告。"
-                        research_progress[query_key]["final_report"] = current_state['final_report']
-                        research_progress[query_key]["final_report_info"] = f"Final Report generated, length: {len(current_state['final_report'])}"
-                        research_progress[query_key]["is_complete"] = True
-                        completed_reports[query_key] = {
-                            "query": query,
-                            "report": current_state['final_report'],
-                            "timestamp": datetime.now().isoformat(),
-                            "elapsed_time": time.time() - research_progress[query_key]["start_time"],
-                        }
-                    elif current_state.get('accumulated_findings'):
-                        research_progress[query_key]["progress"] = "研究进行中... 累积发现概要: " + (current_state['accumulated_findings'][:200]) + "..." if current_state['accumulated_findings'] else "无"
-                        research_progress[query_key]["synthesizer_info"] = f"Synthesized findings length: {len(current_state['accumulated_findings'])}"
-                    elif current_state.get('current_task'):
-                        task_preview = str(current_state['current_task'])
-                        if len(task_preview) > 100:
-                            task_preview = task_preview[:100] + "..."
-                        research_progress[query_key]["progress"] = f"研究进行中... 当前任务: {task_preview}"
-                    else:
-                        research_progress[query_key]["progress"] = "研究进行中..."
-                research_progress[query_key]["elapsed_time"] = time.time() - research_progress[query_key]["start_time"]
-            if not research_progress[query_key]["is_complete"]:
-                research_progress[query_key]["progress"] = "研究完成，但未能生成报告。"
-                research_progress[query_key]["is_complete"] = True
-                research_progress[query_key]["elapsed_time"] = time.time() - research_progress[query_key]["start_time"]
+            with bypass_llm_cache(force_refresh), \
+                    TRACE_STORE.activate(run_id) as trace, span("run", "run", query=query, resumed=inputs is None):
+                async for output in app_graph.astream(inputs, config=run_config):
+                    for key, value in output.items():
+                        if key != '__end__':
+                            log_entry_content = str(value)
+                            if len(log_entry_content) > 500:
+                                log_entry_content = log_entry_content[:500] + "..."
+                            # 结构化日志，带 step type
+                            log_entry = {"type": key, "content": log_entry_content}
+                            if isinstance(value, dict) and value.get("dedup_tokens_saved"):
+                                research_progress[run_id]["dedup_tokens_saved"] += value["dedup_tokens_saved"]
+                            if isinstance(value, dict):
+                                _track_budget(run_id, budget_view, value)
+                            research_progress[run_id]["logs"].append(log_entry)
+                            research_progress[run_id]["streaming"].pop(key, None)
+                            _publish_log(run_id, log_entry)
+                            print(f"Stream output: {log_entry}")
+                    last_output_key = list(output.keys())[-1]
+                    current_state = output.get('__end__') or output.get(last_output_key)
+                    if current_state:
+                        if current_state.get('final_report'):
+                            research_progress[run_id]["progress"] = "研究完成，生成报告。"
+                            research_progress[run_id]["final_report"] = current_state['final_report']
+                            research_progress[run_id]["final_report_info"] = f"Final Report generated, length: {len(current_state['final_report'])}"
+                            research_progress[run_id]["is_complete"] = True
+                            await asyncio.to_thread(
+                                report_store.save, run_id, query, current_state['final_report'], datetime.now().isoformat(),
+                                time.time() - research_progress[run_id]["start_time"],
+                                meta={"token_usage": research_progress[run_id]["token_usage"],
+                                      "budget_stop_reason": research_progress[run_id]["budget_stop_reason"],
+                                      "profile": trace.profile() if trace is not None else None},
+                            )
+                        elif current_state.get('accumulated_findings'):
+                            research_progress[run_id]["progress"] = "研究进行中... 累积发现概要: " + (current_state['accumulated_findings'][:200]) + "..." if current_state['accumulated_findings'] else "无"
+                            research_progress[run_id]["synthesizer_info"] = f"Synthesized findings length: {len(current_state['accumulated_findings'])}"
+                            if "synthesis_tokens_saved" in current_state:
+                                research_progress[run_id]["synthesis_tokens_saved"] = current_state["synthesis_tokens_saved"]
+                            if current_state.get("novelty_scores"):
+                                research_progress[run_id]["novelty_scores"] = current_state["novelty_scores"]
+                                research_progress[run_id]["converged"] = bool(current_state.get("converged"))
+                        elif current_state.get('current_task'):
+                            task_preview = str(current_state['current_task'])
+                            if len(task_preview) > 100:
+                                task_preview = task_preview[:100] + "..."
+                            research_progress[run_id]["progress"] = f"研究进行中... 当前任务: {task_preview}"
+                        else:
+                            research_progress[run_id]["progress"] = "研究进行中..."
+                    research_progress[run_id]["elapsed_time"] = time.time() - research_progress[run_id]["start_time"]
+                    _publish_state(run_id)
+            if not research_progress[run_id]["is_complete"]:
+                research_progress[run_id]["progress"] = "研究完成，但未能生成报告。"
+                research_progress[run_id]["is_complete"] = True
+                research_progress[run_id]["elapsed_time"] = time.time() - research_progress[run_id]["start_time"]
         except Exception as e:
             import traceback
             print(f"\n❌ An error occurred during graph execution: {e}")
             print(traceback.format_exc())
-            research_progress[query_key]["progress"] = f"研究执行期间发生错误: {e}"
-            research_progress[query_key]["elapsed_time"] = time.time() - research_progress[query_key]["start_time"]
-            research_progress[query_key]["is_complete"] = True
-            research_progress[query_key]["error"] = str(e)
-            completed_reports[query_key] = {
-                "query": query,
-                "report": f"研究执行期间发生错误: {e}",
-                "timestamp": datetime.now().isoformat(),
-                "elapsed_time": time.time() - research_progress[query_key]["start_time"],
-                "error": str(e),
-            }
-    asyncio.create_task(run())
-    return {"report": "研究已启动，请稍后查看研究进度。"}
+            research_progress[run_id]["progress"] = f"研究执行期间发生错误: {e}"
+            research_progress[run_id]["elapsed_time"] = time.time() - research_progress[run_id]["start_time"]
+            research_progress[run_id]["is_complete"] = True
+            research_progress[run_id]["error"] = str(e)
+            research_progress[run_id]["resumable"] = app_graph.checkpointer is not None
+            await asyncio.to_thread(
+                report_store.save, run_id, query, f"研究执行期间发生错误: {e}", datetime.now().isoformat(),
+                research_progress[run_id]["elapsed_time"], error=str(e),
+            )
+        finally:
+            succeeded = research_progress[run_id]["final_report"] and not research_progress[run_id]["error"]
+            # 出错的研究保留本地检索索引，供恢复后的 final_report 等节点继续使用
+            if not research_progress[run_id]["resumable"]:
+                release_run_index(run_id)
+            search_prefetcher.discard(run_id)
+            if coalesce_key is not None:
+                inflight_runs.pop(coalesce_key, None)
+                if succeeded:
+                    reusable_runs[coalesce_key] = (run_id, time.time())
+            if succeeded and not CHECKPOINT_KEEP_COMPLETED and hasattr(app_graph.checkpointer, "adelete_thread"):
+                await app_graph.checkpointer.adelete_thread(run_id)
+            _publish_state(run_id)
+            channel.close()
+            completed_runs.append(run_id)
+            _evict_completed_progress()
+
+    return run
+
+def _client_identity(request: Request):
+    # 调度器按此标识做公平排队与单客户端限额，只取服务端可见的对端地址，不信任请求体中的自报标识
+    return request.client.host if request.client else "anonymous"
+
+def _request_priority(data):
+    # 数值越小越优先；请求方未经认证，只允许降低自己的优先级（不小于默认的 0）。不是整数时返回 None，由调用方返回 400
+    try:
+        return max(0, int(data.get("priority") or 0))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+async def _submit_run(run_id, run, client_id, priority, coalesce_key=None):
+    try:
+        position = await research_scheduler.submit(run_id, run, client_id=client_id, priority=priority)
+    except QueueFullError as e:
+        research_progress[run_id].update({"progress": f"研究未能启动: {e}", "is_complete": True, "error": str(e)})
+        if coalesce_key is not None:
+            inflight_runs.pop(coalesce_key, None)
+        _publish_state(run_id)
+        progress_channels[run_id].close()
+        return JSONResponse(status_code=429, content={"report": f"错误：{e}", "run_id": run_id})
+    research_progress[run_id]["queue_position"] = position
+    _publish_state(run_id)
+    return position
+
+# /research 接口，接收 plan，分步产出进度
+@app.post("/research")
+async def start_research(request: Request):
+    data = await request.json()
+    query = data.get("query")
+    plan = data.get("plan")
+    max_iterations = data.get("max_iterations", 3)
+    force_refresh = bool(data.get("force_refresh", False))
+    # force_refresh 既跳过结果复用，也跳过搜索缓存与 LLM 响应缓存
+    bypass_search_cache = bool(data.get("bypass_search_cache", False)) or force_refresh
+    fan_out = bool(data.get("fan_out", False))
+    fanout_width = int(data.get("fanout_width", FANOUT_WIDTH))
+    max_concurrency = int(data.get("max_concurrency", FANOUT_MAX_CONCURRENCY))
+    client_id = _client_identity(request)
+    priority = _request_priority(data)
+    if priority is None:
+        return JSONResponse(status_code=400, content={"report": "错误：priority 必须是整数。"})
+    early_stop = bool(data.get("early_stop", EARLY_STOP_ENABLED))
+    warm_start = bool(data.get("warm_start", PLAN_WARM_START))
+    # 预算模式：在时间（秒）/ token 预算内尽量给出最好的报告，0 表示不限
+    time_budget = float(data.get("time_budget") or 0)
+    token_budget = int(data.get("token_budget") or 0)
+    if not query or not plan:
+        return {"report": "错误：未提供研究主题或计划。"}
+    coalesce_key = _coalesce_key(query, plan, max_iterations, fan_out, fanout_width, early_stop, time_budget, token_budget, warm_start,
+                                 bypass_search_cache, force_refresh)
+    # 相同研究正在进行时直接合并到该研究，共享同一进度流
+    inflight_run_id = inflight_runs.get(coalesce_key)
+    if inflight_run_id is not None:
+        query_runs[query] = inflight_run_id
+        research_progress[inflight_run_id]["coalesced_requests"] += 1
+        return {"report": "相同的研究正在进行，已合并到该研究。", "run_id": inflight_run_id, "coalesced": True,
+                "queue_position": research_scheduler.position(inflight_run_id)}
+    reusable_run_id = None if force_refresh else _find_reusable_run(coalesce_key)
+    if reusable_run_id is not None:
+        query_runs[query] = reusable_run_id
+        research_progress[reusable_run_id]["coalesced_requests"] += 1
+        return {"report": "已复用最近完成的相同研究。", "run_id": reusable_run_id, "reused": True}
+    run_id = uuid.uuid4().hex
+    query_runs[query] = run_id
+    inflight_runs[coalesce_key] = run_id
+    # 初始化进度
+    _init_progress(run_id, query)
+    inputs: ResearchState = {
+        "run_id": run_id,
+        "initial_query": query,
+        "current_task": plan,
+        "max_iterations": max_iterations,
+        # warm start 时已确认的计划即第一轮 planner 的输出，从第 1 轮开始计数
+        "current_iteration": 1 if warm_start else 0,
+        "research_history": [],
+        "accumulated_findings": "无初始发现。",
+        "final_report": "",
+        "bypass_search_cache": bypass_search_cache,
+        "force_refresh": force_refresh,
+        "synthesized_count": 0,
+        "synthesis_tokens_saved": 0,
+        "dedup_tokens_saved": 0,
+        "fan_out": fan_out,
+        "fanout_width": fanout_width,
+        "sub_tasks": parse_sub_tasks(plan, fanout_width) if warm_start and fan_out else [],
+        "warm_start": warm_start,
+        "source_urls": [],
+        "novelty_source_count": 0,
+        "early_stop": early_stop,
+        "novelty_scores": [],
+        "converged": False,
+        "time_budget": time_budget,
+        "token_budget": token_budget,
+        "started_at": 0,
+        "paused_seconds": 0,
+        "node_costs": [],
+        "issued_queries": [],
+        "prefetch_queries": [],
+        "planned_queries": _planned_queries((normalize_query(query), fan_out, fanout_width), plan) if warm_start and not fan_out else [],
+    }
+    run = _make_run(run_id, query, inputs, max_concurrency, coalesce_key)
+    position = await _submit_run(run_id, run, client_id, priority, coalesce_key)
+    if isinstance(position, JSONResponse):
+        return position
+    return {"report": "研究已提交，请稍后查看研究进度。", "run_id": run_id, "queue_position": position}
+
+# 从最后一个检查点恢复中断的研究：已完成的节点不再重跑，只重新执行未完成的节点
+@app.post("/research/{run_id}/resume")
+async def resume_research(run_id: str, request: Request):
+    data = await request.json() if await request.body() else {}
+    if app_graph.checkpointer is None:
+        return JSONResponse(status_code=400, content={"error": "未启用检查点，无法恢复研究。"})
+    progress = research_progress.get(run_id)
+    if progress is not None and not progress["is_complete"]:
+        return JSONResponse(status_code=409, content={"error": "该研究仍在进行中。", "run_id": run_id})
+    snapshot = await app_graph.aget_state({"configurable": {"thread_id": run_id}})
+    if not snapshot.values:
+        return JSONResponse(status_code=404, content={"error": "未找到该研究的检查点。", "run_id": run_id})
+    if not snapshot.next:
+        return JSONResponse(status_code=409, content={"error": "该研究已执行完毕，无需恢复。", "run_id": run_id})
+    query = snapshot.values["initial_query"]
+    max_concurrency = int(data.get("max_concurrency", FANOUT_MAX_CONCURRENCY))
+    client_id = _client_identity(request)
+    priority = _request_priority(data)
+    if priority is None:
+        return JSONResponse(status_code=400, content={"error": "priority 必须是整数。", "run_id": run_id})
+    if run_id in completed_runs:
+        completed_runs.remove(run_id)
+    query_runs[query] = run_id
+    _init_progress(run_id, query)
+    log_entry = {"type": "resume", "content": f"从检查点恢复，待执行节点: {', '.join(snapshot.next)}"}
+    research_progress[run_id]["logs"].append(log_entry)
+    _publish_log(run_id, log_entry)
+    checkpoint_time = datetime.fromisoformat(snapshot.created_at).timestamp() if snapshot.created_at else None
+    run = _make_run(run_id, query, None, max_concurrency, checkpoint_values=snapshot.values, checkpoint_time=checkpoint_time)
+    position = await _submit_run(run_id, run, client_id, priority)
+    if isinstance(position, JSONResponse):
+        return position
+    return {"report": "研究已从检查点恢复，请稍后查看研究进度。", "run_id": run_id, "resumed_from": list(snapshot.next), "queue_position": position}
 
 @app.get("/research_progress")
-async def get_research_progress(query: str):
+async def get_research_progress(query: str = None, run_id: str = None):
     global research_progress
-    query_key = query
-    progress_data = research_progress.get(query_key, {
+    resolved_run_id = _resolve_run_id(query, run_id)
+    if resolved_run_id not in research_progress:
+        report_data = await asyncio.to_thread(report_store.get, run_id) if run_id else (
+            await asyncio.to_thread(report_store.latest_for_query, query) if query else None)
+        if report_data:
+            return JSONResponse(content=_stored_progress(report_data))
+    run_id = resolved_run_id
+    if run_id in research_progress and not research_progress[run_id]["is_complete"]:
+        research_progress[run_id]["queue_position"] = research_scheduler.position(run_id)
+    progress_data = research_progress.get(run_id, {
         "report": "研究尚未启动或未找到研究进度。",
         "final_report": None,
         "is_complete": True,
@@ -150,30 +562,112 @@ async def get_research_progress(query: str):
     })
     return JSONResponse(content=progress_data)
 
+# SSE 推送：按顺序推送日志 (log) 与状态变化 (state) 事件，支持 Last-Event-ID 续传，研究结束后关闭连接
+@app.get("/research_stream")
+async def stream_research_progress(request: Request, query: str = None, run_id: str = None):
+    run_id = _resolve_run_id(query, run_id)
+    channel = progress_channels.get(run_id)
+    if channel is None:
+        return JSONResponse(status_code=404, content={"error": "研究尚未启动或未找到研究进度。"})
+    last_event_id = request.headers.get("last-event-id", "")
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    def streaming_snapshot():
+        # 订阅时各节点已生成的部分输出（token 事件不重放）
+        streaming = research_progress.get(run_id, {}).get("streaming")
+        return {"type": "streaming", "data": dict(streaming)} if streaming else None
+
+    async def event_source():
+        async for event in channel.listen(start, heartbeat=STREAM_HEARTBEAT, snapshot=streaming_snapshot):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            # 瞬时事件不带 id，不影响客户端的 Last-Event-ID
+            event_id = f"id: {event['id']}\n" if event["id"] is not None else ""
+            yield f"{event_id}event: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/completed_reports")
-async def list_completed_reports():
-    global completed_reports
-    report_list = []
-    for query, data in completed_reports.items():
-        report_list.append({
-            "query": data["query"],
-            "timestamp": data["timestamp"],
-            "elapsed_time": data["elapsed_time"],
-            "has_error": "error" in data,
-        })
-    report_list.sort(key=lambda x: x["timestamp"], reverse=True)
-    return report_list
+async def list_completed_reports(limit: int = 20, cursor: str = None, q: str = None):
+    # 按完成时间倒序分页，next_cursor 传回即可取下一页；带 q 时返回全文检索结果
+    limit = max(1, min(limit, 100))
+    if q:
+        return {"reports": await asyncio.to_thread(report_store.search, q, limit), "next_cursor": None}
+    try:
+        return await asyncio.to_thread(report_store.list, limit, cursor)
+    except (ValueError, TypeError):
+        return JSONResponse(status_code=400, content={"error": "无效的分页游标。"})
 
 @app.get("/report/{query:path}")
 async def get_report(query: str):
-    global completed_reports
-    query_key = query
-    report_data = completed_reports.get(query_key)
+    # 路径参数既可以是 run_id（主键查询），也可以是原始查询（取该查询最近一次研究）
+    report_data = await asyncio.to_thread(report_store.get, query) or await asyncio.to_thread(report_store.latest_for_query, query)
     if report_data:
-        return {"query": report_data["query"], "report": report_data["report"], "timestamp": report_data["timestamp"], "elapsed_time": report_data["elapsed_time"], "error": report_data.get("error")}
+        return {"run_id": report_data["run_id"], "query": report_data["query"], "report": report_data["report"], "timestamp": report_data["timestamp"], "elapsed_time": report_data["elapsed_time"], "error": report_data["error"],
+                "token_usage": report_data["meta"].get("token_usage"), "budget_stop_reason": report_data["meta"].get("budget_stop_reason")}
     else:
         return {"report": "未找到该研究报告。", "error": "Report not found"}
 
+@app.get("/runs/{run_id}/profile")
+async def get_run_profile(run_id: str):
+    # 内存中有追踪记录时实时汇总（进行中的研究也可查看），否则取报告存储中完成时保存的汇总
+    trace = TRACE_STORE.get(run_id)
+    if trace is not None:
+        return trace.profile()
+    report_data = await asyncio.to_thread(report_store.get, run_id)
+    if report_data and report_data["meta"].get("profile"):
+        return report_data["meta"]["profile"]
+    return JSONResponse(status_code=404, content={"error": "未找到该研究的追踪记录。", "run_id": run_id})
+
+@app.get("/runs/{run_id}/trace")
+async def get_run_trace(run_id: str, format: str = "chrome"):
+    # format=chrome 导出 Chrome trace 事件（chrome://tracing、Perfetto），format=otel 导出 OTLP/JSON
+    trace = TRACE_STORE.get(run_id)
+    if trace is None:
+        return JSONResponse(status_code=404, content={"error": "未找到该研究的追踪记录。", "run_id": run_id})
+    if format == "otel":
+        return trace.otel()
+    if format != "chrome":
+        return JSONResponse(status_code=400, content={"error": f"不支持的导出格式: {format}（可选 chrome / otel）"})
+    return JSONResponse(content=trace.chrome_trace(), headers={"Content-Disposition": f'attachment; filename="trace-{run_id}.json"'})
+
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        return JSONResponse(status_code=404, content={"error": "指标未启用（METRICS_ENABLED）。"})
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/scheduler")
+async def get_scheduler_stats():
+    return research_scheduler.stats()
+
+@app.get("/search_backends")
+async def get_search_backends():
+    return backend_pool.stats()
+
+@app.get("/search_cache")
+async def get_search_cache_stats():
+    return search_cache.stats()
+
+@app.get("/search_prefetch")
+async def get_search_prefetch_stats():
+    return search_prefetcher.stats()
+
+@app.get("/llm_cache")
+async def get_llm_cache_stats():
+    return LLM.stats()
+
+@app.get("/llm_routes")
+async def get_llm_route_stats():
+    return model_router.stats()
+
+@app.get("/llm_gateway")
+async def get_llm_gateway_stats():
+    return LLM_GATEWAY.stats()
+
 # Mount static files (like index.html, CSS, JS if separate)
 # IMPORTANT: Ensure 'static' directory exists and contains your index.html and other static assets.
 STATIC_FILES_DIR = "static"
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+from abc import ABC, abstractmethod
+import time
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from tracing import add_span_observer
+
+# 直方图分桶（秒 / token 数）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """返回该指标各组标签的样本行（文本格式），由 Counter / Gauge / Histogram 实现。"""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def set(self, value: Optional[float], **labels):
+        key = self._key(labels)
+        if value is None:
+            self._values.pop(key, None)
+        else:
+            self._values[key] = value
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：各分桶的（非累积）计数 + 超出最大分桶的计数、总和
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内指标注册表：热路径上只做字典与计数更新，采集时（GET /metrics）才调用 collector 刷新状态类指标并生成文本格式。"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"指标采集失败: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+NODE_LATENCY = registry.register(Histogram("hasaki_node_duration_seconds", "Graph node execution time.", ("node",)))
+NODE_ERRORS = registry.register(Counter("hasaki_node_errors_total", "Graph node executions that raised.", ("node",)))
+LLM_LATENCY = registry.register(Histogram("hasaki_llm_duration_seconds", "LLM call latency, including cache lookups.", ("model", "cache")))
+LLM_TOKENS = registry.register(Histogram("hasaki_llm_tokens", "Tokens per LLM call.", ("model", "kind"), buckets=TOKEN_BUCKETS))
+LLM_QUEUE_WAIT = registry.register(Histogram("hasaki_llm_queue_wait_seconds", "Time LLM calls waited for a gateway concurrency slot.", ("backend",)))
+LLM_ERRORS = registry.register(Counter("hasaki_llm_errors_total", "LLM calls that failed.", ("model",)))
+SEARCH_LATENCY = registry.register(Histogram("hasaki_search_duration_seconds", "Search latency by result source.", ("source",)))
+SEARCH_ERRORS = registry.register(Counter("hasaki_search_errors_total", "Searches that failed."))
+FETCH_LATENCY = registry.register(Histogram("hasaki_fetch_duration_seconds", "Page fetch latency by result source.", ("source",)))
+FETCH_BYTES = registry.register(Counter("hasaki_fetch_bytes_total", "Bytes downloaded by page fetches."))
+CACHE_REQUESTS = registry.register(Counter("hasaki_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result")))
+RUNS = registry.register(Counter("hasaki_runs_total", "Research runs finished, by status.", ("status",)))
+EVENT_LOOP_LAG = registry.register(Histogram("hasaki_event_loop_lag_seconds", "Event loop scheduling delay.", buckets=LOOP_LAG_BUCKETS))
+CACHE_HIT_RATIO = registry.register(Gauge("hasaki_cache_hit_ratio", "Cache hit ratio since process start.", ("cache",)))
+# 以下状态类指标由 main 注册的 collector 在采集时刷新
+QUEUE_DEPTH = registry.register(Gauge("hasaki_research_queue_depth", "Research runs waiting in the scheduler queue."))
+ACTIVE_RUNS = registry.register(Gauge("hasaki_research_active_runs", "Research runs currently executing."))
+LLM_GATEWAY_LIMIT = registry.register(Gauge("hasaki_llm_gateway_limit", "Adaptive concurrency limit per LLM backend.", ("backend",)))
+LLM_GATEWAY_IN_FLIGHT = registry.register(Gauge("hasaki_llm_gateway_in_flight", "LLM calls in flight per backend.", ("backend",)))
+LLM_GATEWAY_QUEUE_DEPTH = registry.register(Gauge("hasaki_llm_gateway_queue_depth", "LLM calls waiting for a concurrency slot per backend.", ("backend",)))
+PREFETCH_PENDING = registry.register(Gauge("hasaki_search_prefetch_pending", "Prefetched searches not yet used or discarded."))
+
+
+def _observe_span(record: Dict[str, Any]):
+    # 由 tracing 在每个 span 结束时调用：按类别更新直方图与计数器
+    category, attrs, duration = record["cat"], record["attrs"], record["duration"]
+    if attrs.get("cancelled"):
+        # 被取消的调用（如丢弃的预取）不计入延迟与错误
+        return
+    failed = "error" in attrs
+    if category == "node":
+        NODE_LATENCY.observe(duration, node=record["name"])
+        if failed:
+            NODE_ERRORS.inc(node=record["name"])
+    elif category == "llm":
+        model = attrs.get("model", "")
+        if failed:
+            LLM_ERRORS.inc(model=model)
+            return
+        cache = "hit" if attrs.get("cache_hit") else "miss"
+        LLM_LATENCY.observe(duration, model=model, cache=cache)
+        CACHE_REQUESTS.inc(cache="llm", result=cache)
+        for kind in ("prompt", "completion"):
+            if f"{kind}_tokens" in attrs:
+                LLM_TOKENS.observe(attrs[f"{kind}_tokens"], model=model, kind=kind)
+        if "queue_wait" in attrs:
+            LLM_QUEUE_WAIT.observe(attrs["queue_wait"], backend=attrs.get("backend", ""))
+    elif category == "search":
+        if failed:
+            SEARCH_ERRORS.inc()
+            return
+        source = "cache" if attrs.get("cache_hit") else "coalesced" if attrs.get("coalesced") else "backend"
+        SEARCH_LATENCY.observe(duration, source=source)
+        CACHE_REQUESTS.inc(cache="search", result="hit" if source == "cache" else "miss")
+    elif category == "fetch":
+        source = "cache" if attrs.get("cache_hit") else "network"
+        FETCH_LATENCY.observe(duration, source=source)
+        FETCH_BYTES.inc(attrs.get("bytes", 0) if source == "network" else 0)
+        CACHE_REQUESTS.inc(cache="page", result="hit" if source == "cache" else "miss")
+    elif category == "run":
+        RUNS.inc(status="failed" if failed else "completed")
+
+
+def _collect_cache_hit_ratios():
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), count in CACHE_REQUESTS._values.items():
+        entry = totals.setdefault(cache, [0, 0])
+        entry[0 if result == "hit" else 1] += count
+    for cache, (hits, misses) in totals.items():
+        CACHE_HIT_RATIO.set(hits / (hits + misses) if hits + misses else None, cache=cache)
+
+
+registry.add_collector(_collect_cache_hit_ratios)
+
+
+def enable_span_metrics():
+    add_span_observer(_observe_span)
+
+
+async def monitor_event_loop_lag(interval: float):
+    # 每隔 interval 秒睡眠一次，实际唤醒时间超出 interval 的部分即事件循环的调度延迟
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
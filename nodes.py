@@ -1,15 +1,108 @@
 import asyncio
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List
 from langchain_core.messages import AIMessage
-from config import LLM
+from langchain_core.runnables import RunnableConfig
+from config import (
+    SYNTHESIZER_INCREMENTAL,
+    FANOUT_WIDTH,
+    FETCH_ENABLED,
+    FETCH_TOP_K,
+    FETCH_MAX_CHARS_PER_PAGE,
+    RETRIEVAL_ENABLED,
+    PROMPT_TOKEN_BUDGETS,
+    DEDUP_ENABLED,
+    STREAM_SYNTHESIZER,
+    STREAM_FINAL_REPORT,
+    EARLY_STOP_ENABLED,
+    MAP_REDUCE_ENABLED,
+    QUERY_REWRITE_ENABLED,
+    QUERY_REWRITE_COUNT,
+    FUSED_RESULTS,
+    PIPELINE_PREFETCH_ENABLED,
+    PIPELINE_PREFETCH_QUERIES,
+)
+from novelty import novelty_score, has_converged
+from summarize import map_reduce_summarize
+from dedup import dedupe_sources
+from fetcher import page_fetcher
 from research_state import ResearchState
 from browser_use import Agent, Browser, BrowserConfig
 from browser_use.llm.messages import UserMessage
-import requests
+from retrieval import BM25Index, format_passages, index_document, retrieve_passages
+from llm_router import model_router
+from llm_stream import astream_completion
+from prefetch import search_prefetcher
+from search import amulti_search, asearxng_search
+from search_cache import normalize_query
+from token_utils import estimate_tokens
 
 # 初始化 browser
 browser = Browser()
 
+# 查询改写生成的候选数：前 QUERY_REWRITE_COUNT 条本轮检索，其余留给流水线预取
+QUERY_CANDIDATES = QUERY_REWRITE_COUNT + (PIPELINE_PREFETCH_QUERIES if PIPELINE_PREFETCH_ENABLED else 0)
+
+async def _invoke_llm(prompt: str, node_name: str) -> str:
+    # 经模型路由调用该节点配置的模型（含回退链、并发上限与超时）
+    response = await model_router.route(node_name).ainvoke([UserMessage(content=prompt)])
+    return response.completion.strip() if hasattr(response, "completion") else str(response).strip()
+
+async def _stream_llm(prompt: str, config: RunnableConfig, node_name: str) -> str:
+    # 流式生成：每段输出通过 configurable 中的 on_token 回调转发给进度通道
+    on_token = ((config or {}).get("configurable") or {}).get("on_token")
+    if on_token is None:
+        return await _invoke_llm(prompt, node_name)
+    parts = []
+    async for delta in astream_completion(model_router.route(node_name), [UserMessage(content=prompt)]):
+        parts.append(delta)
+        on_token(node_name, delta)
+    return "".join(parts).strip()
+
+def parse_sub_tasks(text: str, limit: int) -> List[str]:
+    sub_tasks = []
+    for line in text.splitlines():
+        match = re.match(r"^\s*(?:[-*]|\d+[.、)]?)?\s*子问题\s*\d*\s*[:：]\s*(.+)$", line)
+        if match and match.group(1).strip():
+            sub_tasks.append(match.group(1).strip())
+    return sub_tasks[:limit]
+
+async def generate_search_queries(task: str, initial_query: str, issued: List[str] = (),
+                                  limit: int = QUERY_CANDIDATES, prefetched: List[str] = ()) -> List[str]:
+    # 把当前任务改写为若干条适合直接搜索的关键词查询，去掉本次研究中已发出过的查询
+    issued_keys = {normalize_query(q) for q in issued}
+    candidates = []
+    if QUERY_REWRITE_ENABLED and task and task != initial_query:
+        issued_text = "\n".join(f"- {q}" for q in issued) or "无"
+        prompt = f"""研究主题: \"{initial_query}\"
+当前研究任务:
+{task}
+本次研究已搜索过的查询:
+{issued_text}
+"""
+        if prefetched:
+            # 已在后台预取结果的候选查询，与任务相关时优先选用
+            prompt += "以下查询已预取搜索结果，与当前任务相关时请优先选用：\n" + "\n".join(f"- {q}" for q in prefetched) + "\n"
+        prompt += f"""请把当前研究任务改写为最多 {limit} 条互不重复、适合直接输入搜索引擎的简短关键词查询，分别覆盖任务的不同方面，不要与已搜索过的查询重复。
+每行一个，格式为“查询: <关键词>”。"""
+        try:
+            text = await _invoke_llm(prompt, "researcher")
+            for line in text.splitlines():
+                match = re.match(r"^\s*(?:[-*]|\d+[.、)]?)?\s*查询\s*\d*\s*[:：]\s*(.+)$", line)
+                if match and match.group(1).strip():
+                    candidates.append(match.group(1).strip())
+        except Exception as e:
+            print(f"查询改写失败，退回原始查询: {e}")
+    if not candidates:
+        candidates = [initial_query]
+    queries = []
+    for query in candidates:
+        key = normalize_query(query)
+        if key and key not in issued_keys:
+            issued_keys.add(key)
+            queries.append(query)
+    return queries[:limit]
+
 async def planner_node(state: ResearchState) -> Dict[str, Any]:
     print("\n--- Planner ---")
     current_iteration = state.get("current_iteration", 0)
@@ -50,78 +143,220 @@ async def planner_node(state: ResearchState) -> Dict[str, Any]:
 如果分析认为当前信息已足够全面回答总体研究主题，请直接输出 \"生成最终报告\"。
 否则，请直接输出下一步任务指令。
 """
-    response = await LLM.ainvoke([UserMessage(content=prompt)])
-    next_task = response.completion.strip() if hasattr(response, "completion") else str(response).strip()
+    fanout_width = state.get("fanout_width", FANOUT_WIDTH) if state.get("fan_out") else 0
+    # 并行分发时 researcher 直接搜索子问题、不改写查询，流水线预取的候选改由 planner 多给出的备选子问题提供
+    spare_width = PIPELINE_PREFETCH_QUERIES if PIPELINE_PREFETCH_ENABLED and fanout_width > 1 else 0
+    if fanout_width > 1:
+        prompt += f"""
+另外，请在任务指令之后把它拆分为最多 {fanout_width} 个可以并行、独立检索的子问题，每行一个，格式为“子问题: <适合直接搜索的关键词>”。
+"""
+        if spare_width:
+            prompt += f"之后再给出最多 {spare_width} 个下一步可能需要的备选子问题，格式相同，排在最后。\n"
+        prefetched = search_prefetcher.candidates(state.get("run_id") or initial_query)
+        if prefetched:
+            prompt += "以下子问题已预取搜索结果，与当前任务相关时请优先选用：\n" + "\n".join(f"- {q}" for q in prefetched) + "\n"
+    next_task = await _invoke_llm(prompt, "planner")
     print(f"Planner generated task: {next_task}")
 
     if "生成最终报告" in next_task:
         if accumulated_findings and len(accumulated_findings) > 50:
             print("Planner suggests generating final report.")
-            return {"current_task": "FINAL_REPORT_TASK", "current_iteration": current_iteration + 1}
+            return {"current_task": "FINAL_REPORT_TASK", "current_iteration": current_iteration + 1, "sub_tasks": []}
         else:
             print("Planner suggested report, but findings are insufficient. Forcing further research.")
             fallback_task = f"继续深入研究 '{initial_query}' 的核心方面，寻找更具体的细节、例子或证据。"
-            return {"current_task": fallback_task, "current_iteration": current_iteration + 1}
+            # 清空上一轮的子问题，兜底任务由单个 researcher 改写查询后研究
+            return {"current_task": fallback_task, "current_iteration": current_iteration + 1, "sub_tasks": []}
 
-    return {
+    result = {
         "current_task": next_task,
         "current_iteration": current_iteration + 1
     }
-
-def searxng_search(query, searxng_url="https://search.mdosch.de", num_results=10):
-    params = {
-        "q": query,
-        "format": "json",
-        "language": "zh-CN",
-        "safesearch": 0,
-    }
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-    }
-    resp = requests.get(f"{searxng_url}/search", params=params, headers=headers, timeout=15)
-    resp.raise_for_status()
-    data = resp.json()
-    return [
-        {
-            "title": r.get("title"),
-            "content": r.get("content"),
-            "url": r.get("url")
-        }
-        for r in data.get("results", [])[:num_results]
-    ]
+    if fanout_width > 1:
+        candidates = parse_sub_tasks(next_task, fanout_width + spare_width)
+        result["sub_tasks"] = candidates[:fanout_width]
+        if spare_width:
+            # 备选子问题在本轮合成期间预取
+            result["prefetch_queries"] = candidates[fanout_width:]
+        print(f"Planner fan-out sub-tasks: {result['sub_tasks']}")
+    return result
 
 async def researcher_node(state: ResearchState) -> Dict[str, Any]:
     print("\n--- Researcher ---")
-    # 只用纯关键词搜索，避免 403
-    search_query = state.get("initial_query", "")
+    # 并行分发时研究分配到的子问题，否则研究 planner 给出的当前任务
+    initial_query = state.get("initial_query", "")
+    search_query = state.get("sub_task") or state.get("current_task") or initial_query
     if not search_query or search_query == "FINAL_REPORT_TASK":
         return {"research_history": [AIMessage(content=f"跳过研究节点。任务: {search_query}")]}
-    search_results = searxng_search(search_query)
-    search_text = "\n\n".join([f"{item['title']}\n{item['content']}\n{item['url']}" for item in search_results])
-    prompt = f"请根据以下多引擎搜索结果，提取与 '{search_query}' 相关的核心信息，并对比不同来源：\n{search_text}\n请用中文总结。"
-    response = await LLM.ainvoke([UserMessage(content=prompt)])
-    summary = response.completion.strip()
-    return {"research_history": [AIMessage(content=f"研究任务: {search_query}\n研究结果:\n{summary}")]}
-
-async def synthesizer_node(state: ResearchState) -> Dict[str, Any]:
+    run_id = state.get("run_id") or initial_query
+    issued = state.get("issued_queries") or []
+    use_cache = not state.get("bypass_search_cache", False)
+    spare_queries = {}
+    if state.get("sub_task"):
+        # 子问题本身就是关键词，直接搜索
+        queries = [] if normalize_query(search_query) in {normalize_query(q) for q in issued} else [search_query]
+    elif state.get("planned_queries"):
+        # warm start 第一轮：使用 /plan 预取时已改写出的候选查询（前几条的搜索结果已在缓存中），用后清空
+        issued_keys = {normalize_query(q) for q in issued}
+        candidates = [q for q in state["planned_queries"] if normalize_query(q) not in issued_keys]
+        queries = candidates[:QUERY_REWRITE_COUNT]
+        spare_queries = {"prefetch_queries": candidates[QUERY_REWRITE_COUNT:], "planned_queries": []}
+    else:
+        # 只用纯关键词搜索，避免 403：把任务指令改写为多条关键词查询，多出的候选留给合成期间预取
+        candidates = await generate_search_queries(search_query, initial_query, issued,
+                                                   prefetched=search_prefetcher.candidates(run_id))
+        queries = candidates[:QUERY_REWRITE_COUNT]
+        spare_queries = {"prefetch_queries": candidates[QUERY_REWRITE_COUNT:]}
+    if not queries:
+        print("当前任务的查询均已搜索过，跳过本轮检索。")
+        return {"research_history": [AIMessage(content=f"跳过研究节点，查询均已搜索过。任务: {search_query}")], **spare_queries}
+    prefetched = search_prefetcher.take(run_id, queries)
+    print(f"Search queries: {queries}, prefetched: {len(prefetched)}")
+
+    async def search_one(query):
+        task = prefetched.get(normalize_query(query))
+        if task is not None and not task.cancelled():
+            try:
+                return await task
+            except Exception as e:
+                # 预取失败（多为瞬时错误）不应让本轮丢掉这条查询，重新检索一次
+                print(f"预取搜索失败，重新检索 '{query}': {e}")
+        return await asearxng_search(query, use_cache=use_cache)
+
+    search_results = await amulti_search(queries, limit=FUSED_RESULTS, search=search_one)
+    page_texts = {}
+    if FETCH_ENABLED and search_results:
+        # 并发抓取前几个结果的网页正文，替代只看搜索摘要
+        pages = await page_fetcher.fetch_many([item["url"] for item in search_results[:FETCH_TOP_K]])
+        page_texts = {page["url"]: page["text"] for page in pages if page["text"]}
+        print(f"Fetched {len(page_texts)}/{len(pages)} pages")
+    sources = [
+        {"url": item["url"], "title": item["title"] or "", "content": item["content"] or "",
+         "text": "\n".join(t for t in (item["content"], page_texts.get(item["url"])) if t)}
+        for item in search_results
+    ]
+    dedup_tokens_saved = 0
+    if DEDUP_ENABLED:
+        # 多个引擎返回的转载/镜像内容只保留一份，其余链接合并为引用
+        deduped, dedup_tokens_saved = await asyncio.to_thread(dedupe_sources, sources)
+        print(f"Dedup: {len(sources)} -> {len(deduped)} sources, tokens saved: {dedup_tokens_saved}")
+        sources = deduped
+    if RETRIEVAL_ENABLED:
+        # 摘要与正文入本次研究的索引，只取与当前检索相关、且在 token 预算内的片段
+        for source in sources:
+            await asyncio.to_thread(index_document, run_id, source["url"], source["text"], source["title"], source.get("urls"))
+        # 只检索本轮的来源，之前几轮已被综合吸收的片段不再重复摘要；最终报告仍检索整个研究的索引
+        passages = await asyncio.to_thread(retrieve_passages, run_id, " ".join(queries), PROMPT_TOKEN_BUDGETS["researcher"],
+                                           {source["url"] for source in sources})
+        blocks = [format_passages([passage], start=i) for i, passage in enumerate(passages, 1)]
+    else:
+        blocks = [
+            f"{source['title']}\n{source['content']}\n{' '.join(source.get('urls') or [source['url']])}"
+            + (f"\n正文摘录:\n{page_texts[source['url']][:FETCH_MAX_CHARS_PER_PAGE]}" if source["url"] in page_texts else "")
+            for source in sources
+        ]
+
+    def research_prompt(search_text):
+        return f"请根据以下多引擎搜索结果，提取与 '{search_query}' 相关的核心信息，并对比不同来源：\n{search_text}\n请用中文总结。"
+
+    if MAP_REDUCE_ENABLED and blocks:
+        # 来源分批并发摘要，再逐层合并部分摘要，避免小模型在单个长提示上丢失信息
+        summary = await map_reduce_summarize(
+            blocks,
+            map_prompt=research_prompt,
+            reduce_prompt=lambda partials: f"以下是关于 '{search_query}' 的多份分批搜索结果摘要，请合并为一份完整的中文总结，保留各来源的关键信息、来源编号与不同来源之间的异同：\n{partials}",
+            invoke=lambda prompt: _invoke_llm(prompt, "researcher"),
+        )
+    else:
+        summary = await _invoke_llm(research_prompt("\n\n".join(blocks)), "researcher")
+    return {
+        "research_history": [AIMessage(content=f"研究任务: {search_query}\n研究结果:\n{summary}")],
+        "dedup_tokens_saved": dedup_tokens_saved,
+        "source_urls": [url for source in sources for url in source.get("urls") or [source["url"]]],
+        "issued_queries": queries,
+        **spare_queries,
+    }
+
+def _synthesis_prompt(initial_query, results_text, prior_findings=None):
+    if prior_findings:
+        return f"""已有关于 \"{initial_query}\" 的累积发现概要:
+{prior_findings}
+新增研究信息片段:
+{results_text}
+请在已有累积发现的基础上整合新增信息，输出更新后的简洁、连贯的累积发现概要。"""
+    return f"""整合以下关于 \"{initial_query}\" 的研究信息，生成更新的累积发现概要。如果已有一些累积发现，请在新的发现基础上更新它。
+研究信息片段:
+{results_text}
+请输出简洁、连贯的累积发现概要。"""
+
+async def synthesizer_node(state: ResearchState, config: RunnableConfig = None) -> Dict[str, Any]:
     print("\n--- Synthesizer ---")
     initial_query = state["initial_query"]
+    if PIPELINE_PREFETCH_ENABLED:
+        # 流水线：合成本轮结果的同时在后台检索下一轮的候选查询；上一轮未被选用的预取结果在此丢弃
+        run_id = state.get("run_id") or initial_query
+        search_prefetcher.discard(run_id)
+        if state.get("current_iteration", 0) < state.get("max_iterations", 3):
+            search_prefetcher.start(run_id, state.get("prefetch_queries") or [], use_cache=not state.get("bypass_search_cache", False))
     research_history_messages = state.get("research_history", [])
     research_results = [msg.content for msg in research_history_messages if isinstance(msg, AIMessage) and isinstance(msg.content, str) and "研究结果:" in msg.content]
-    if not research_results:
+    # 增量模式：只把尚未吸收的研究结果与已有累积发现一起交给 LLM
+    absorbed = state.get("synthesized_count", 0) if SYNTHESIZER_INCREMENTAL else 0
+    new_results = research_results[absorbed:]
+    if not new_results:
+        # 查询均已搜索过等情况下本轮没有新信息，记为新颖度 0 计入收敛判断，避免再多跑一轮 planner 与 researcher
         print("无新的研究结果可供合成。")
-        return {"accumulated_findings": state.get("accumulated_findings", "无")}
-    all_results_text = "\n\n".join(research_results)
-    prompt = f"""整合以下关于 \"{initial_query}\" 的研究信息，生成更新的累积发现概要。如果已有一些累积发现，请在新的发现基础上更新它。
-研究信息片段:
-{all_results_text}
-请输出简洁、连贯的累积发现概要。"""
-    response = await LLM.ainvoke([UserMessage(content=prompt)])
-    updated_findings = response.completion.strip() if hasattr(response, "completion") else str(response).strip()
-    print(f"Synthesized findings length: {len(updated_findings)}")
-    return {"accumulated_findings": updated_findings}
+        iteration = state.get("current_iteration", 0)
+        novelty_scores = list(state.get("novelty_scores") or []) + [
+            {"iteration": iteration, "findings_novelty": 0.0, "source_novelty": 0.0, "score": 0.0}
+        ]
+        converged = has_converged(novelty_scores, iteration, state.get("early_stop", EARLY_STOP_ENABLED))
+        print(f"Novelty: {novelty_scores[-1]}, converged: {converged}")
+        return {
+            "accumulated_findings": state.get("accumulated_findings", "无"),
+            "novelty_scores": novelty_scores,
+            "converged": converged,
+        }
+    prior_findings = state.get("accumulated_findings", "") if absorbed > 0 else ""
+    new_results_text = "\n\n".join(new_results)
+    budget = PROMPT_TOKEN_BUDGETS["synthesizer"]
+    if RETRIEVAL_ENABLED and estimate_tokens(new_results_text) > budget:
+        # 新增内容超出预算时，只保留与研究主题最相关的片段
+        index = BM25Index()
+        for i, result in enumerate(new_results):
+            index.add_document(f"result-{i}", result)
+        new_results_text = "\n\n".join(p["text"] for p in index.retrieve(initial_query, budget))
+    prompt = _synthesis_prompt(initial_query, new_results_text, prior_findings)
+    # 统计相对于全量重建提示词节省的 token
+    full_prompt_tokens = estimate_tokens(_synthesis_prompt(initial_query, "\n\n".join(research_results)))
+    tokens_saved = max(0, full_prompt_tokens - estimate_tokens(prompt))
+    if STREAM_SYNTHESIZER:
+        updated_findings = await _stream_llm(prompt, config, "synthesizer")
+    else:
+        updated_findings = await _invoke_llm(prompt, "synthesizer")
+    print(f"Synthesized findings length: {len(updated_findings)}, new results: {len(new_results)}, prompt tokens saved: {tokens_saved}")
+    # 边际新颖度：本轮相对上一轮累积发现与已见来源新增了多少内容，供 should_continue 判断是否收敛
+    novelty_scores = list(state.get("novelty_scores") or [])
+    source_urls = state.get("source_urls") or []
+    seen_count = state.get("novelty_source_count", 0)
+    previous_findings = state.get("accumulated_findings", "") if novelty_scores else ""
+    novelty = await asyncio.to_thread(
+        novelty_score, previous_findings, updated_findings, source_urls[:seen_count], source_urls[seen_count:],
+        state.get("current_iteration", 0),
+    )
+    novelty_scores.append(novelty)
+    converged = has_converged(novelty_scores, state.get("current_iteration", 0), state.get("early_stop", EARLY_STOP_ENABLED))
+    print(f"Novelty: {novelty}, converged: {converged}")
+    return {
+        "accumulated_findings": updated_findings,
+        "synthesized_count": len(research_results),
+        "synthesis_tokens_saved": state.get("synthesis_tokens_saved", 0) + tokens_saved,
+        "novelty_source_count": len(source_urls),
+        "novelty_scores": novelty_scores,
+        "converged": converged,
+    }
 
-async def final_report_node(state: ResearchState) -> Dict[str, Any]:
+async def final_report_node(state: ResearchState, config: RunnableConfig = None) -> Dict[str, Any]:
     print("\n--- Final Report Generator ---")
     initial_query = state["initial_query"]
     accumulated_findings = state.get("accumulated_findings", "未能积累发现。")
@@ -138,12 +373,20 @@ async def final_report_node(state: ResearchState) -> Dict[str, Any]:
                 step_counter += 1
         if step_counter == 1:
             history_summary_for_report = ""
+    evidence_for_report = ""
+    if RETRIEVAL_ENABLED:
+        run_id = state.get("run_id") or initial_query
+        passages = await asyncio.to_thread(retrieve_passages, run_id, initial_query, PROMPT_TOKEN_BUDGETS["final_report"])
+        if passages:
+            evidence_for_report = f"\n\n相关原文片段（可作为引用来源）：\n{format_passages(passages)}\n"
     prompt = f"""研究主题: \"{initial_query}\"
 核心累积发现:
 {accumulated_findings}
-{history_summary_for_report if history_summary_for_report else "无详细研究步骤回顾。"}
+{history_summary_for_report if history_summary_for_report else "无详细研究步骤回顾。"}{evidence_for_report}
 请基于以上信息，撰写一份全面、结构清晰的研究报告."""
-    response = await LLM.ainvoke([UserMessage(content=prompt)])
-    report = response.completion.strip() if hasattr(response, "completion") else str(response).strip()
+    if STREAM_FINAL_REPORT:
+        report = await _stream_llm(prompt, config, "final_report_generator")
+    else:
+        report = await _invoke_llm(prompt, "final_report_generator")
     print(f"Final Report generated, length: {len(report)}")
     return {"final_report": report}
@@ -0,0 +1,49 @@
+from typing import Dict, List, Any, Set, Tuple
+
+from config import (EARLY_STOP_ENABLED, NOVELTY_THRESHOLD, NOVELTY_NGRAM, NOVELTY_SOURCE_WEIGHT,
+                    NOVELTY_MIN_ITERATIONS, NOVELTY_PATIENCE)
+from retrieval import tokenize
+
+
+def shingles(text: str, n: int = NOVELTY_NGRAM) -> Set[Tuple[str, ...]]:
+    tokens = tokenize(text)
+    if len(tokens) < n:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def text_novelty(previous: str, current: str) -> float:
+    # 新文本中未在旧文本出现过的 n-gram 占比：1 表示全新，0 表示没有新内容
+    current_shingles = shingles(current)
+    if not current_shingles:
+        return 0.0
+    return len(current_shingles - shingles(previous)) / len(current_shingles)
+
+
+def source_novelty(previous_urls: List[str], new_urls: List[str]) -> float:
+    # 本轮来源中首次出现的占比；本轮没有来源时视为没有新增
+    new_set = set(new_urls)
+    if not new_set:
+        return 0.0
+    return len(new_set - set(previous_urls)) / len(new_set)
+
+
+def novelty_score(previous_findings: str, findings: str, previous_urls: List[str], new_urls: List[str],
+                  iteration: int) -> Dict[str, Any]:
+    """计算一轮研究的边际新颖度：累积发现的 n-gram 新增比例与新来源比例的加权平均。"""
+    findings_novelty = text_novelty(previous_findings, findings)
+    sources_novelty = source_novelty(previous_urls, new_urls)
+    score = (1 - NOVELTY_SOURCE_WEIGHT) * findings_novelty + NOVELTY_SOURCE_WEIGHT * sources_novelty
+    return {
+        "iteration": iteration,
+        "findings_novelty": round(findings_novelty, 3),
+        "source_novelty": round(sources_novelty, 3),
+        "score": round(score, 3),
+    }
+
+
+def has_converged(novelty_scores: List[Dict[str, Any]], iteration: int, early_stop: bool = EARLY_STOP_ENABLED) -> bool:
+    # 最近 NOVELTY_PATIENCE 轮的边际新颖度都低于阈值，说明继续研究已学不到新内容
+    if not early_stop or iteration < NOVELTY_MIN_ITERATIONS or len(novelty_scores) < NOVELTY_PATIENCE:
+        return False
+    return all(entry["score"] < NOVELTY_THRESHOLD for entry in novelty_scores[-NOVELTY_PATIENCE:])
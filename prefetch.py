@@ -0,0 +1,68 @@
+import asyncio
+from typing import Dict, List, Any, Tuple
+
+from config import FETCH_ENABLED, FETCH_TOP_K
+from fetcher import page_fetcher
+from search import asearxng_search
+from search_cache import normalize_query
+
+
+class SearchPrefetcher:
+    """按研究（run_id）管理下一轮的预取搜索：合成期间在后台检索候选查询并抓取正文，
+    下一轮 researcher 取走用得上的结果，其余在下一轮合成开始或研究结束时丢弃。"""
+
+    def __init__(self):
+        self._runs: Dict[str, Dict[str, Tuple[str, asyncio.Task]]] = {}
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    async def _prefetch(self, query: str, use_cache: bool) -> List[Dict[str, Any]]:
+        results = await asearxng_search(query, use_cache=use_cache)
+        if FETCH_ENABLED and results:
+            try:
+                await page_fetcher.fetch_many([item["url"] for item in results[:FETCH_TOP_K]])
+            except Exception as e:
+                print(f"预取网页失败 '{query}': {e}")
+        return results
+
+    def start(self, run_id: str, queries: List[str], use_cache: bool = True):
+        pending = self._runs.setdefault(run_id, {})
+        for query in queries:
+            key = normalize_query(query)
+            if key and key not in pending:
+                task = asyncio.ensure_future(self._prefetch(query, use_cache))
+                # 未被取走的任务失败时不产生“异常未获取”的警告
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                pending[key] = (query, task)
+                self.started += 1
+
+    def candidates(self, run_id: str) -> List[str]:
+        return [query for query, _ in self._runs.get(run_id, {}).values()]
+
+    def take(self, run_id: str, queries: List[str]) -> Dict[str, asyncio.Task]:
+        # 取走与本轮查询相同的预取任务（归一化查询 -> 任务），剩余的保留到 discard
+        pending = self._runs.get(run_id, {})
+        taken = {}
+        for query in queries:
+            key = normalize_query(query)
+            if key in pending:
+                taken[key] = pending.pop(key)[1]
+        self.used += len(taken)
+        return taken
+
+    def discard(self, run_id: str):
+        for _, task in self._runs.pop(run_id, {}).values():
+            task.cancel()
+            self.discarded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": sum(len(p) for p in self._runs.values()),
+            "started": self.started,
+            "used": self.used,
+            "discarded": self.discarded,
+        }
+
+
+search_prefetcher = SearchPrefetcher()
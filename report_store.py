@@ -0,0 +1,181 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+from config import REPORT_STORE_PATH, REPORT_MAX_COUNT, REPORT_RETENTION_DAYS
+
+
+def _encode_cursor(created_at: float, run_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, run_id]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    created_at, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return float(created_at), str(run_id)
+
+
+class ReportStore:
+    """研究报告的持久化存储（SQLite + WAL）。
+
+    按 run_id 主键查询，按完成时间建索引做游标分页，FTS5（trigram 分词，支持中文子串）做全文检索；
+    超过保留天数或总数上限的旧报告会被清理。
+    """
+
+    def __init__(self, path=REPORT_STORE_PATH, max_count=REPORT_MAX_COUNT, retention_days=REPORT_RETENTION_DAYS):
+        self.path = path
+        self.max_count = max_count
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS reports (
+                run_id TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                report TEXT NOT NULL,
+                error TEXT,
+                timestamp TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                elapsed_time REAL NOT NULL,
+                meta TEXT NOT NULL DEFAULT '{}'
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at, run_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_query ON reports (query, created_at)")
+        self.fts_enabled = self._init_fts()
+        self._conn.commit()
+
+    def _init_fts(self) -> bool:
+        # 外部内容 FTS5 表，由触发器与 reports 表保持同步；SQLite 不支持 FTS5/trigram 时退回 LIKE 检索
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5("
+                "query, report, content='reports', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            return False
+        self._conn.executescript(
+            """CREATE TRIGGER IF NOT EXISTS reports_ai AFTER INSERT ON reports BEGIN
+                INSERT INTO reports_fts (rowid, query, report) VALUES (new.rowid, new.query, new.report);
+            END;
+            CREATE TRIGGER IF NOT EXISTS reports_ad AFTER DELETE ON reports BEGIN
+                INSERT INTO reports_fts (reports_fts, rowid, query, report) VALUES ('delete', old.rowid, old.query, old.report);
+            END;
+            CREATE TRIGGER IF NOT EXISTS reports_au AFTER UPDATE ON reports BEGIN
+                INSERT INTO reports_fts (reports_fts, rowid, query, report) VALUES ('delete', old.rowid, old.query, old.report);
+                INSERT INTO reports_fts (rowid, query, report) VALUES (new.rowid, new.query, new.report);
+            END;"""
+        )
+        # 重建索引，清除旧版本 INSERT OR REPLACE 遗留的过期条目（报告数有上限，开销很小）
+        self._conn.execute("INSERT INTO reports_fts (reports_fts) VALUES ('rebuild')")
+        return True
+
+    @staticmethod
+    def _row_to_dict(row, with_report=True) -> Dict[str, Any]:
+        data = {
+            "run_id": row["run_id"],
+            "query": row["query"],
+            "timestamp": row["timestamp"],
+            "elapsed_time": row["elapsed_time"],
+            "error": row["error"],
+        }
+        if with_report:
+            data["report"] = row["report"]
+            data["meta"] = json.loads(row["meta"] or "{}")
+        else:
+            data["has_error"] = row["error"] is not None
+        return data
+
+    def save(self, run_id: str, query: str, report: str, timestamp: str, elapsed_time: float,
+             error: Optional[str] = None, meta: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            # 同一 run_id 再次保存（如恢复后完成）时走 UPDATE，由 reports_au 触发器同步 FTS；
+            # INSERT OR REPLACE 的隐式删除不触发 reports_ad，会在全文索引中留下旧内容
+            self._conn.execute(
+                "INSERT INTO reports (run_id, query, report, error, timestamp, created_at, elapsed_time, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET query = excluded.query, report = excluded.report, error = excluded.error, "
+                "timestamp = excluded.timestamp, created_at = excluded.created_at, elapsed_time = excluded.elapsed_time, "
+                "meta = excluded.meta",
+                (run_id, query, report, error, timestamp, time.time(), elapsed_time, json.dumps(meta or {}, ensure_ascii=False)),
+            )
+            self._conn.commit()
+        self.enforce_retention()
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reports WHERE run_id = ?", (run_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def latest_for_query(self, query: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM reports WHERE query = ? ORDER BY created_at DESC LIMIT 1", (query,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list(self, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        # 按完成时间倒序的键集分页：游标记录上一页最后一条的 (created_at, run_id)
+        params: List[Any] = []
+        where = ""
+        if cursor:
+            created_at, run_id = _decode_cursor(cursor)
+            where = "WHERE (created_at, run_id) < (?, ?)"
+            params.extend([created_at, run_id])
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT run_id, query, error, timestamp, created_at, elapsed_time FROM reports {where} "
+                "ORDER BY created_at DESC, run_id DESC LIMIT ?",
+                params,
+            ).fetchall()
+        next_cursor = _encode_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["run_id"]) if len(rows) > limit else None
+        return {"reports": [self._row_to_dict(r, with_report=False) for r in rows[:limit]], "next_cursor": next_cursor}
+
+    def search(self, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+        text = text.strip()
+        if not text:
+            return []
+        with self._lock:
+            # trigram 分词要求检索词至少 3 个字符，更短的检索词退回 LIKE
+            if self.fts_enabled and len(text) >= 3:
+                phrase = '"' + text.replace('"', '""') + '"'
+                rows = self._conn.execute(
+                    "SELECT r.run_id, r.query, r.error, r.timestamp, r.elapsed_time FROM reports_fts "
+                    "JOIN reports r ON r.rowid = reports_fts.rowid WHERE reports_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (phrase, limit),
+                ).fetchall()
+            else:
+                pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = self._conn.execute(
+                    "SELECT run_id, query, error, timestamp, elapsed_time FROM reports "
+                    "WHERE query LIKE ? ESCAPE '\\' OR report LIKE ? ESCAPE '\\' ORDER BY created_at DESC LIMIT ?",
+                    (pattern, pattern, limit),
+                ).fetchall()
+        return [self._row_to_dict(r, with_report=False) for r in rows]
+
+    def enforce_retention(self) -> int:
+        removed = 0
+        with self._lock:
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                removed += self._conn.execute("DELETE FROM reports WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_count:
+                removed += self._conn.execute(
+                    "DELETE FROM reports WHERE run_id IN (SELECT run_id FROM reports ORDER BY created_at DESC, run_id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_count,),
+                ).rowcount
+            if removed:
+                self._conn.commit()
+        return removed
+
+
+report_store = ReportStore()
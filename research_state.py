@@ -1,8 +1,10 @@
+import operator
 from typing import TypedDict, List, Annotated, Dict, Any
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage
 
 class ResearchState(TypedDict):
+    run_id: str
     initial_query: str
     current_task: str
     research_history: Annotated[List[BaseMessage], add_messages]
@@ -10,3 +12,36 @@ class ResearchState(TypedDict):
     final_report: str
     max_iterations: int
     current_iteration: int
+    bypass_search_cache: bool
+    # 为 True 时整个研究不读 LLM 响应缓存，见 main._make_run
+    force_refresh: bool
+    synthesized_count: int
+    synthesis_tokens_saved: int
+    fan_out: bool
+    fanout_width: int
+    sub_tasks: List[str]
+    sub_task: str
+    # 带已确认计划的研究从 researcher 开始，不再在入口重跑 planner
+    warm_start: bool
+    # 各 researcher 实例（含并行分发）上报的去重节省 token 数，按加法归并
+    dedup_tokens_saved: Annotated[int, operator.add]
+    # 各 researcher 实例本轮使用的来源 URL，按加法归并；novelty_source_count 为上一轮合成时已计入的条数
+    source_urls: Annotated[List[str], operator.add]
+    novelty_source_count: int
+    # 是否启用收敛检测、每轮的边际新颖度记录，以及是否已收敛（收敛后直接生成最终报告）
+    early_stop: bool
+    novelty_scores: List[Dict[str, Any]]
+    converged: bool
+    # 时间与 token 预算（0 表示不限），研究开始时间，以及各节点每次执行的用量记录（按加法归并）
+    time_budget: float
+    token_budget: int
+    started_at: float
+    # 研究中断到恢复执行之间的累计时长（秒），不计入时间预算；并行节点写入同一值，取较大者
+    paused_seconds: Annotated[float, max]
+    node_costs: Annotated[List[Dict[str, Any]], operator.add]
+    # 本次研究中已发出的搜索查询（按加法归并），查询改写时跳过
+    issued_queries: Annotated[List[str], operator.add]
+    # researcher 改写查询时多出的候选查询，synthesizer 合成期间在后台预取
+    prefetch_queries: List[str]
+    # /plan 预取时由已确认的计划改写出的查询，warm start 的第一轮 researcher 直接使用，不再改写
+    planned_queries: List[str]
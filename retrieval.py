@@ -0,0 +1,184 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Any, Optional, Collection
+
+from config import RETRIEVAL_CHUNK_TOKENS, RETRIEVAL_CROSS_RUN, RETRIEVAL_MAX_GLOBAL_CHUNKS
+from token_utils import estimate_tokens
+
+_LATIN_RE = re.compile(r"[a-z0-9]+")
+_CJK_RUN_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;\n])|(?<=\.)\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    # 拉丁字符按词切分，中文按字二元组切分（单字成段时保留单字）
+    text = (text or "").lower()
+    terms = _LATIN_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def chunk_text(text: str, max_tokens: int = RETRIEVAL_CHUNK_TOKENS) -> List[str]:
+    # 按句子累积成块，每块约 max_tokens 个 token
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in _SENTENCE_RE.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = estimate_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class BM25Index:
+    """基于倒排表的 BM25 检索索引，文档先切块再入库，检索粒度为块。"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_chunks: Optional[int] = None):
+        self.k1 = k1
+        self.b = b
+        self.max_chunks = max_chunks
+        self.chunks: Dict[int, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.total_length = 0
+        # 来源 -> 索引中该来源的块数，来源的最后一个块被淘汰时移除，之后可重新入库
+        self.sources: Dict[str, int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add_document(self, source: str, text: str, title: str = "", urls: Optional[List[str]] = None) -> int:
+        if not text:
+            return 0
+        added = 0
+        with self._lock:
+            for chunk in chunk_text(text):
+                terms = tokenize(chunk)
+                if not terms:
+                    continue
+                chunk_id = self._next_id
+                self._next_id += 1
+                self.chunks[chunk_id] = {"source": source, "urls": urls or [source], "title": title, "text": chunk, "length": len(terms)}
+                for term, tf in Counter(terms).items():
+                    self.postings[term][chunk_id] = tf
+                self.total_length += len(terms)
+                added += 1
+            if added:
+                self.sources[source] = self.sources.get(source, 0) + added
+            if self.max_chunks is not None:
+                while len(self.chunks) > self.max_chunks:
+                    self._remove(min(self.chunks))
+        return added
+
+    def _remove(self, chunk_id: int):
+        chunk = self.chunks.pop(chunk_id)
+        self.total_length -= chunk["length"]
+        remaining = self.sources[chunk["source"]] - 1
+        if remaining:
+            self.sources[chunk["source"]] = remaining
+        else:
+            del self.sources[chunk["source"]]
+        for term in set(tokenize(chunk["text"])):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query: str, k: int = 10, sources: Optional[Collection[str]] = None) -> List[Dict[str, Any]]:
+        # sources 不为 None 时只在这些来源的块中检索（IDF 仍按整个索引计算）
+        with self._lock:
+            n = len(self.chunks)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores: Dict[int, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if sources is not None and self.chunks[chunk_id]["source"] not in sources:
+                        continue
+                    length = self.chunks[chunk_id]["length"]
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [{**self.chunks[chunk_id], "score": score} for chunk_id, score in ranked]
+
+    def retrieve(self, query: str, token_budget: int, k: int = 50, sources: Optional[Collection[str]] = None) -> List[Dict[str, Any]]:
+        # 按相关度从高到低选取片段，直到用完 token 预算
+        selected = []
+        used = 0
+        for passage in self.search(query, k=k, sources=sources):
+            tokens = estimate_tokens(passage["text"])
+            if used + tokens > token_budget:
+                continue
+            selected.append(passage)
+            used += tokens
+        return selected
+
+
+def format_passages(passages: List[Dict[str, Any]], start: int = 1) -> str:
+    return "\n\n".join(
+        f"[{i}] {p['title'] or p['source']}\n{' '.join(p.get('urls') or [p['source']])}\n{p['text']}" for i, p in enumerate(passages, start)
+    )
+
+
+# --- 索引注册表 ---
+# 每次研究一个索引；开启 RETRIEVAL_CROSS_RUN 时另有一个跨研究共享的全局索引
+_run_indexes: Dict[str, BM25Index] = {}
+_registry_lock = threading.Lock()
+global_index = BM25Index(max_chunks=RETRIEVAL_MAX_GLOBAL_CHUNKS) if RETRIEVAL_CROSS_RUN else None
+
+
+def get_run_index(run_id: str) -> BM25Index:
+    with _registry_lock:
+        index = _run_indexes.get(run_id)
+        if index is None:
+            index = BM25Index()
+            _run_indexes[run_id] = index
+        return index
+
+
+def release_run_index(run_id: str):
+    with _registry_lock:
+        _run_indexes.pop(run_id, None)
+
+
+def index_document(run_id: str, source: str, text: str, title: str = "", urls: Optional[List[str]] = None) -> int:
+    if global_index is not None and source not in global_index.sources:
+        global_index.add_document(source, text, title, urls)
+    index = get_run_index(run_id)
+    if source in index.sources:
+        return 0
+    return index.add_document(source, text, title, urls)
+
+
+def retrieve_passages(run_id: str, query: str, token_budget: int, sources: Optional[Collection[str]] = None) -> List[Dict[str, Any]]:
+    # sources 限定本次研究索引中参与检索的来源（如 researcher 只取本轮检索到的来源），为 None 时检索全部已入库来源
+    run_index = get_run_index(run_id)
+    passages = run_index.retrieve(query, token_budget, sources=sources)
+    if global_index is not None:
+        # 全局索引补充本次研究之外的来源，剩余预算内按相关度追加
+        used = sum(estimate_tokens(p["text"]) for p in passages)
+        seen = {p["text"] for p in passages}
+        extra = [p for p in global_index.retrieve(query, token_budget - used)
+                 if p["text"] not in seen and p["source"] not in run_index.sources]
+        passages.extend(extra)
+    return passages
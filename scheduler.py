@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+from typing import Awaitable, Callable, Dict, List, Any, Optional
+
+from config import SCHEDULER_MAX_WORKERS, SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_PER_CLIENT
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, job_id: str, client_id: str, priority: int, factory: Callable[[], Awaitable[Any]]):
+        self.job_id = job_id
+        self.client_id = client_id
+        self.priority = priority
+        self.factory = factory
+        self.state = "queued"
+
+
+class ResearchScheduler:
+    """研究任务调度器：固定数量的工作协程 + 有界优先级队列 + 按客户端公平排队。
+
+    同一优先级内按起始时间公平排队（start-time fair queuing）：每个客户端的任务标签依次递增，
+    多个客户端的任务交替出队，单个客户端的突发提交不会饿死其他客户端。
+    """
+
+    def __init__(self, max_workers=SCHEDULER_MAX_WORKERS, max_queue=SCHEDULER_MAX_QUEUE, max_per_client=SCHEDULER_MAX_PER_CLIENT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self._heap: List[tuple] = []
+        self._jobs: Dict[str, _Job] = {}
+        self._client_tags: Dict[str, int] = {}
+        self._client_active: Dict[str, int] = {}
+        self._virtual_time = 0
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _ensure_started(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Condition()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def submit(self, job_id: str, factory: Callable[[], Awaitable[Any]], client_id: str = "anonymous", priority: int = 0) -> int:
+        # 入队成功返回排队位置（从 1 开始）；队列已满或客户端排队过多时拒绝
+        self._ensure_started()
+        if len(self._heap) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"研究队列已满（{self.max_queue}），请稍后再试。")
+        if self._client_active.get(client_id, 0) >= self.max_per_client:
+            self.rejected += 1
+            raise QueueFullError(f"该客户端已有 {self.max_per_client} 个研究在排队或运行，请稍后再试。")
+        job = _Job(job_id, client_id, priority, factory)
+        tag = max(self._virtual_time, self._client_tags.get(client_id, 0)) + 1
+        self._client_tags[client_id] = tag
+        self._client_active[client_id] = self._client_active.get(client_id, 0) + 1
+        self._jobs[job_id] = job
+        heapq.heappush(self._heap, (priority, tag, next(self._seq), job))
+        async with self._wakeup:
+            self._wakeup.notify()
+        return self.position(job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        # 仍在排队时返回位置（从 1 开始），已开始或不存在时返回 None
+        job = self._jobs.get(job_id)
+        if job is None or job.state != "queued":
+            return None
+        ordered = sorted(self._heap, key=lambda entry: entry[:3])
+        for i, entry in enumerate(ordered, 1):
+            if entry[3] is job:
+                return i
+        return None
+
+    def job_state(self, job_id: str) -> Optional[str]:
+        job = self._jobs.get(job_id)
+        return job.state if job else None
+
+    async def _worker(self):
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: self._heap)
+                _, tag, _, job = heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, tag)
+            job.state = "running"
+            self.running += 1
+            # 任务在单独的 Task 中执行：任务自身被取消（CancelledError）只算失败，工作协程继续取下一个任务；
+            # 只有工作协程本身被取消时才退出，并一同取消正在执行的任务
+            try:
+                task = asyncio.ensure_future(job.factory())
+                try:
+                    await asyncio.wait({task})
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                if task.cancelled():
+                    self.failed += 1
+                    print(f"调度器: 任务 {job.job_id} 被取消")
+                elif task.exception() is not None:
+                    self.failed += 1
+                    print(f"调度器: 任务 {job.job_id} 执行失败: {task.exception()}")
+                else:
+                    self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"调度器: 任务 {job.job_id} 执行失败: {e}")
+            finally:
+                job.state = "done"
+                self.running -= 1
+                self._client_active[job.client_id] -= 1
+                if not self._client_active[job.client_id]:
+                    del self._client_active[job.client_id]
+                self._jobs.pop(job.job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": len(self._heap),
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "active_clients": len(self._client_active),
+        }
+
+
+research_scheduler = ResearchScheduler()
@@ -0,0 +1,300 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Any, Optional
+
+from config import (
+    SEARXNG_URLS,
+    SEARCH_HEDGE_MIN_DELAY,
+    SEARCH_BREAKER_FAILURES,
+    SEARCH_BREAKER_COOLDOWN,
+    RRF_K,
+)
+from http_client import HttpClient
+from search_cache import search_cache
+from tracing import span
+
+search_client = HttpClient()
+
+
+class SearchBackend:
+    """单个 SearXNG 实例的延迟统计与熔断状态。"""
+
+    def __init__(self, url: str, breaker_failures=SEARCH_BREAKER_FAILURES, breaker_cooldown=SEARCH_BREAKER_COOLDOWN):
+        self.url = url.rstrip("/")
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.latencies = deque(maxlen=100)
+        self.ewma: Optional[float] = None
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+
+    def available(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.breaker_cooldown:
+            return True
+        return False
+
+    def p95(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def weight(self) -> float:
+        # 尚无样本的实例按 1 秒估计，保证新实例也能被选中
+        return 1.0 / max(self.ewma if self.ewma is not None else 1.0, 0.05)
+
+    def on_start(self):
+        # 在选中实例时同步调用：冷却期已过的实例转为半开，同一时刻只放行这一个探测请求
+        self.requests += 1
+        if self.state == "open":
+            self.state = "half_open"
+
+    def on_cancel(self):
+        # 被对冲请求取代的探测没有结论，重新开始冷却，避免被取消的探测变成接连不断的新探测
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def on_success(self, latency: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.latencies.append(latency)
+        self.ewma = latency if self.ewma is None else 0.8 * self.ewma + 0.2 * latency
+        self.state = "closed"
+
+    def on_failure(self, error: Exception):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if self.state == "half_open" or self.consecutive_failures >= self.breaker_failures:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "url": self.url,
+            "state": self.state,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency": round(self.ewma, 3) if self.ewma is not None else None,
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """SearXNG 实例池：延迟加权选择 + 对冲请求 + 熔断 + 失败转移。"""
+
+    def __init__(self, urls: List[str], client: HttpClient = None, hedge_min_delay=SEARCH_HEDGE_MIN_DELAY,
+                 breaker_failures=SEARCH_BREAKER_FAILURES, breaker_cooldown=SEARCH_BREAKER_COOLDOWN):
+        self.backends = [SearchBackend(url, breaker_failures, breaker_cooldown) for url in urls]
+        self.client = client or search_client
+        self.hedge_min_delay = hedge_min_delay
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def pick(self, exclude=()) -> Optional[SearchBackend]:
+        candidates = [b for b in self.backends if b not in exclude and b.available()]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[b.weight() for b in candidates], k=1)[0]
+
+    def hedge_delay(self, backend: SearchBackend) -> float:
+        p95 = backend.p95()
+        return max(self.hedge_min_delay, p95 if p95 is not None else self.client.timeout / 3)
+
+    async def _request(self, backend: SearchBackend, params: Dict[str, Any]) -> Dict[str, Any]:
+        # 调用方已在选中实例时调用 backend.on_start()
+        start = time.monotonic()
+        try:
+            data = await self.client.get_json(f"{backend.url}/search", params=params)
+        except asyncio.CancelledError:
+            # 被对冲请求取代，不计入失败
+            backend.on_cancel()
+            raise
+        except Exception as e:
+            backend.on_failure(e)
+            raise
+        backend.on_success(time.monotonic() - start)
+        return data
+
+    async def get_json(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        tried = []
+        pending: Dict[asyncio.Task, SearchBackend] = {}
+        last_error: Optional[Exception] = None
+
+        def launch(exclude) -> Optional[SearchBackend]:
+            backend = self.pick(exclude)
+            if backend is not None:
+                # 在创建任务前同步更新熔断状态，同一轮事件循环中的其他请求不会再选中半开的实例
+                backend.on_start()
+                tried.append(backend)
+                pending[asyncio.ensure_future(self._request(backend, params))] = backend
+            return backend
+
+        primary = launch(tried)
+        if primary is None:
+            raise RuntimeError("没有可用的 SearXNG 实例（全部处于熔断状态）")
+        hedged = False
+        try:
+            while pending:
+                timeout = None if hedged else self.hedge_delay(primary)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过 p95 截止时间仍未返回，向另一个实例发起对冲请求
+                    hedged = True
+                    if launch(tried) is not None:
+                        self.hedged_requests += 1
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        if hedged and backend is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                if not pending:
+                    # 全部失败，转移到尚未尝试过的实例
+                    if launch(tried) is not None:
+                        self.failovers += 1
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backends": [b.stats() for b in self.backends],
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
+
+
+backend_pool = BackendPool(SEARXNG_URLS)
+
+
+# 进行中的搜索请求：相同的搜索（如 /plan 触发的预取搜索与随后的研究）共享同一个请求
+_inflight_searches: Dict[tuple, asyncio.Future] = {}
+
+
+async def asearxng_search(query, searxng_url=None, num_results=10, language="zh-CN", engines=None,
+                          use_cache=True) -> List[Dict[str, Any]]:
+    # use_cache=False 时跳过读缓存，但仍用新结果刷新缓存
+    with span("search", "search", query=query, num_results=num_results, cache_hit=False, coalesced=False) as attrs:
+        results = None
+        if use_cache:
+            cached = await asyncio.to_thread(search_cache.get, query, language, engines)
+            if cached is not None:
+                attrs["cache_hit"] = True
+                results = cached[:num_results]
+        if results is None:
+            # 缓存与合并的都是后端返回的完整结果页，按各调用方的 num_results 截取，条数不同的请求可以共享
+            key = (asyncio.get_running_loop(), search_cache.make_key(query, language, engines), searxng_url)
+            task = _inflight_searches.get(key)
+            if task is None:
+                task = asyncio.ensure_future(_search_uncached(query, searxng_url, language, engines))
+                _inflight_searches[key] = task
+                task.add_done_callback(lambda _: _inflight_searches.pop(key, None))
+            else:
+                attrs["coalesced"] = True
+            results = list(await asyncio.shield(task))[:num_results]
+        attrs.update(results=len(results), result_chars=sum(len(r.get("content") or "") for r in results))
+        return results
+
+
+async def _search_uncached(query, searxng_url, language, engines) -> List[Dict[str, Any]]:
+    params = {
+        "q": query,
+        "format": "json",
+        "language": language,
+        "safesearch": 0,
+    }
+    if engines:
+        params["engines"] = ",".join(engines)
+    if searxng_url:
+        data = await search_client.get_json(f"{searxng_url}/search", params=params)
+    else:
+        data = await backend_pool.get_json(params)
+    results = [
+        {
+            "title": r.get("title"),
+            "content": r.get("content"),
+            "url": r.get("url")
+        }
+        for r in data.get("results", [])
+    ]
+    if results:
+        await asyncio.to_thread(search_cache.put, query, language, engines, results)
+    return results
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = RRF_K, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    # 倒数排名融合：按 URL 累加各结果列表中的 1 / (k + 排名)，多个查询都靠前的结果排在前面
+    scores: Dict[str, float] = {}
+    items: Dict[str, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, item in enumerate(results, 1):
+            url = item.get("url")
+            if not url:
+                continue
+            scores[url] = scores.get(url, 0.0) + 1.0 / (k + rank)
+            items.setdefault(url, item)
+    ordered = sorted(scores, key=lambda url: scores[url], reverse=True)
+    return [items[url] for url in ordered[:limit]]
+
+
+async def amulti_search(queries: List[str], num_results=10, use_cache=True, limit: Optional[int] = None,
+                        search=None) -> List[Dict[str, Any]]:
+    # 多条查询并发检索后做倒数排名融合；单条查询失败只记录，不影响其余查询。search 可替换单条查询的检索（如使用预取结果）
+    search = search or (lambda q: asearxng_search(q, num_results=num_results, use_cache=use_cache))
+    results = await asyncio.gather(*(search(q) for q in queries), return_exceptions=True)
+    result_lists = []
+    for query, result in zip(queries, results):
+        if isinstance(result, Exception):
+            print(f"搜索失败 '{query}': {result}")
+        else:
+            result_lists.append(result)
+    if queries and not result_lists:
+        # 全部失败时与单条查询一样抛出异常，由调用方决定是否重试
+        raise results[0]
+    return reciprocal_rank_fusion(result_lists, limit=limit)
+
+
+# --- 同步调用兼容层 ---
+# 同步调用方的请求统一投递到一个后台事件循环上执行，复用该循环上的连接池
+_shim_loop = None
+_shim_lock = threading.Lock()
+
+
+def _get_shim_loop() -> asyncio.AbstractEventLoop:
+    global _shim_loop
+    with _shim_lock:
+        if _shim_loop is None:
+            _shim_loop = asyncio.new_event_loop()
+            threading.Thread(target=_shim_loop.run_forever, name="search-shim-loop", daemon=True).start()
+    return _shim_loop
+
+
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_shim_loop()).result()
+
+
+def searxng_search(query, searxng_url=None, num_results=10, language="zh-CN", engines=None,
+                   use_cache=True) -> List[Dict[str, Any]]:
+    return run_sync(asearxng_search(query, searxng_url=searxng_url, num_results=num_results,
+                                    language=language, engines=engines, use_cache=use_cache))
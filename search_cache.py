@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Any, Optional
+
+from config import SEARCH_CACHE_PATH, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES
+
+
+def normalize_query(query: str) -> str:
+    # 全角转半角、统一大小写、合并空白，去掉首尾标点
+    text = unicodedata.normalize("NFKC", query or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip(" \t\"'“”‘’.,;:!?。，；：！？")
+
+
+class SearchCache:
+    """基于 SQLite 的搜索结果缓存，按 (归一化查询, 语言, 引擎集合) 建键，支持 TTL 与 LRU 淘汰。"""
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                language TEXT NOT NULL,
+                engines TEXT NOT NULL,
+                results TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_last_access ON search_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(query: str, language: str, engines: Optional[List[str]] = None) -> str:
+        engine_set = ",".join(sorted({e.strip().lower() for e in engines or [] if e.strip()}))
+        raw = "\x1f".join([normalize_query(query), language or "", engine_set])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query: str, language: str, engines: Optional[List[str]] = None) -> Optional[List[Dict[str, Any]]]:
+        key = self.make_key(query, language, engines)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT results, created_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query: str, language: str, engines: Optional[List[str]], results: List[Dict[str, Any]]):
+        key = self.make_key(query, language, engines)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, query, language, engines, results, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(query), language or "", ",".join(sorted(engines or [])),
+                 json.dumps(results, ensure_ascii=False), now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                # 按最近访问时间淘汰最久未使用的条目
+                self._conn.execute(
+                    "DELETE FROM search_cache WHERE key IN "
+                    "(SELECT key FROM search_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM search_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+search_cache = SearchCache()
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+from config import MAP_REDUCE_BATCH_TOKENS, MAP_REDUCE_FAN_IN
+from token_utils import estimate_tokens
+
+
+def batch_texts(texts: List[str], max_tokens: int = MAP_REDUCE_BATCH_TOKENS) -> List[List[str]]:
+    # 按顺序把文本装入不超过 max_tokens 的批次；单条超限的文本独占一批
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def map_reduce_summarize(
+    texts: List[str],
+    map_prompt: Callable[[str], str],
+    reduce_prompt: Callable[[str], str],
+    invoke: Callable[[str], Awaitable[str]],
+    batch_tokens: int = MAP_REDUCE_BATCH_TOKENS,
+    fan_in: int = MAP_REDUCE_FAN_IN,
+) -> str:
+    """分批并发摘要（map），再逐层合并部分摘要（reduce），直到只剩一份。
+
+    只有一批时等同于一次普通调用；并发度由 invoke 所经过的模型路由与 LLM 网关限制。
+    """
+    batches = batch_texts(texts, batch_tokens)
+    if not batches:
+        return ""
+    summaries = await asyncio.gather(*(invoke(map_prompt("\n\n".join(batch))) for batch in batches))
+    level = 1
+    while len(summaries) > 1:
+        # 每次合并最多 fan_in 份部分摘要，且不超过批次 token 上限
+        groups = [group[i:i + fan_in] for group in batch_texts(summaries, batch_tokens) for i in range(0, len(group), fan_in)]
+        if len(groups) == len(summaries):
+            # 单份摘要已超出批次上限时仍两两合并，保证每层数量减少
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        print(f"Map-reduce: 第 {level} 层合并 {len(summaries)} 份部分摘要 -> {len(groups)} 份")
+        summaries = await asyncio.gather(*(
+            invoke(reduce_prompt("\n\n".join(f"部分摘要 {i}:\n{s}" for i, s in enumerate(group, 1)))) if len(group) > 1 else _identity(group[0])
+            for group in groups
+        ))
+        level += 1
+    return summaries[0]
+
+
+async def _identity(text: str) -> str:
+    return text
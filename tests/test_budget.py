@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from budget import budget_exhausted, budget_usage, metered
+
+
+def _state(**overrides):
+    state = {
+        "current_iteration": 1,
+        "time_budget": 600,
+        "token_budget": 0,
+        "started_at": time.time() - 3600,
+        "node_costs": [{"node": "synthesizer", "iteration": 1, "tokens": 100, "calls": 1, "seconds": 30}],
+        "accumulated_findings": "",
+    }
+    state.update(overrides)
+    return state
+
+
+def test_time_between_failure_and_resume_is_not_spent():
+    # 开始于一小时前，其中 3540 秒是出错后等待恢复的时间，实际只运行了 60 秒
+    assert budget_exhausted(_state()) is not None
+    resumed = _state(paused_seconds=3540)
+    assert 59 <= budget_usage(resumed)["elapsed_seconds"] <= 61
+    assert budget_exhausted(resumed) is None
+
+
+def test_metered_node_writes_pause_from_config():
+    async def node(state):
+        return {"current_task": "next"}
+
+    wrapped = metered("planner", node)
+    resumed = asyncio.run(wrapped({"current_iteration": 1}, {"configurable": {"paused_seconds": 42.0}}))
+    fresh = asyncio.run(wrapped({"current_iteration": 1}, {"configurable": {}}))
+    assert resumed["paused_seconds"] == 42.0
+    assert "paused_seconds" not in fresh
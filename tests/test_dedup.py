@@ -0,0 +1,32 @@
+from dedup import dedupe_sources, hamming_distance, simhash
+
+ARTICLE = ("研究人员发布了新一代固态电池，能量密度比现有锂离子电池提高一倍，预计三年内量产。"
+           "The new solid-state battery doubles energy density and should reach mass production within three years.")
+
+
+def test_simhash_is_stable_and_close_for_near_duplicates():
+    assert simhash(ARTICLE) == simhash(ARTICLE)
+    mirrored = ARTICLE + " 转载自某科技网站。"
+    unrelated = "今天的天气晴朗，适合户外运动。 The weather is sunny and good for a walk in the park."
+    assert hamming_distance(simhash(ARTICLE), simhash(mirrored)) < hamming_distance(simhash(ARTICLE), simhash(unrelated))
+
+
+def test_dedupe_merges_mirrors_into_first_source():
+    sources = [
+        {"url": "https://origin.example/a", "title": "原文", "text": ARTICLE},
+        {"url": "https://other.example/b", "title": "其他", "text": "完全不同的话题：城市公共交通的票价调整方案与市民反馈。"},
+        {"url": "https://mirror.example/a", "title": "转载", "text": ARTICLE},
+        {"url": "https://origin.example/a", "title": "重复链接", "text": ARTICLE},
+    ]
+    kept, tokens_saved = dedupe_sources(sources)
+    assert [s["url"] for s in kept] == ["https://origin.example/a", "https://other.example/b"]
+    assert kept[0]["urls"] == ["https://origin.example/a", "https://mirror.example/a"]
+    assert kept[1]["urls"] == ["https://other.example/b"]
+    assert tokens_saved > 0
+
+
+def test_sources_without_text_are_never_merged():
+    sources = [{"url": "https://a.example", "text": ""}, {"url": "https://b.example", "text": ""}]
+    kept, tokens_saved = dedupe_sources(sources)
+    assert [s["url"] for s in kept] == ["https://a.example", "https://b.example"]
+    assert tokens_saved == 0
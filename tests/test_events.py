@@ -0,0 +1,39 @@
+import asyncio
+
+from events import EventChannel
+
+
+async def _collect(channel, **kwargs):
+    return [event async for event in channel.listen(**kwargs)]
+
+
+def test_token_events_are_not_kept_for_replay():
+    async def run():
+        channel = EventChannel()
+        channel.publish("log", {"n": 0})
+        listener = asyncio.ensure_future(_collect(channel, snapshot=lambda: {"type": "streaming", "data": {"node": "ab"}}))
+        await asyncio.sleep(0)
+        channel.publish("token", {"node": "node", "delta": "c"}, transient=True)
+        channel.publish("log", {"n": 1})
+        channel.publish("token", {"node": "node", "delta": "d"}, transient=True)
+        channel.close()
+        return channel, await listener
+
+    channel, events = asyncio.run(run())
+    assert [e["type"] for e in channel.events] == ["log", "log"]
+    assert [(e["type"], e["id"]) for e in events] == [
+        ("log", 0), ("streaming", None), ("token", None), ("log", 1), ("token", None),
+    ]
+    assert not channel._listeners
+
+
+def test_late_subscriber_replays_only_numbered_events():
+    async def run():
+        channel = EventChannel()
+        channel.publish("log", {"n": 0})
+        channel.publish("token", {"node": "node", "delta": "x"}, transient=True)
+        channel.publish("state", {"done": True})
+        channel.close()
+        return await _collect(channel, start=1)
+
+    assert [(e["type"], e["id"]) for e in asyncio.run(run())] == [("state", 1)]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import httpcore
+import httpx
+import pytest
+
+from fetcher import PageFetcher, PageStore, UnsafeURLError, check_public_address, check_public_url
+from http_client import HttpClient, PinnedNetworkBackend
+
+PUBLIC_HOST = "93.184.216.34"
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/file",
+    "file:///etc/passwd",
+    "http://127.0.0.1/admin",
+    "http://10.0.0.5/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]:8080/",
+    "http://[::ffff:192.168.1.1]/",
+])
+def test_check_public_url_rejects_unsafe_urls(url):
+    with pytest.raises(UnsafeURLError):
+        asyncio.run(check_public_url(url))
+
+
+def test_check_public_url_accepts_public_ip():
+    asyncio.run(check_public_url(f"https://{PUBLIC_HOST}/page"))
+
+
+def test_fetch_rejects_redirect_to_private_address(tmp_path):
+    requested = []
+
+    async def handler(request):
+        requested.append(str(request.url))
+        if request.url.host == PUBLIC_HOST:
+            return httpx.Response(302, headers={"location": "http://127.0.0.1/secret"})
+        return httpx.Response(200, text="<html><p>internal secret page content that should never be fetched</p></html>",
+                              headers={"content-type": "text/html"})
+
+    async def run():
+        fetcher = PageFetcher(store=PageStore(str(tmp_path / "pages.sqlite3")), transport=httpx.MockTransport(handler))
+        pages = await fetcher.fetch_many([f"http://{PUBLIC_HOST}/start", "gopher://example.com/"])
+        await fetcher.client.aclose()
+        return pages
+
+    pages = asyncio.run(run())
+    assert len(pages) == 1
+    assert "UnsafeURLError" in pages[0]["error"]
+    assert requested == [f"http://{PUBLIC_HOST}/start"]
+
+
+def test_page_store_prunes_expired_and_oldest_pages(tmp_path):
+    store = PageStore(str(tmp_path / "pages.sqlite3"), ttl=3600, max_entries=2)
+    store._conn.execute(
+        "INSERT INTO pages (url, title, text, bytes, truncated, fetched_at) VALUES (?, '', 'old', 3, 0, ?)",
+        ("https://example.com/expired", time.time() - 7200),
+    )
+    store._conn.commit()
+    for i in range(3):
+        store.put({"url": f"https://example.com/{i}", "text": f"page {i}"})
+    urls = {row[0] for row in store._conn.execute("SELECT url FROM pages")}
+    assert urls == {"https://example.com/1", "https://example.com/2"}
+    assert store.evictions == 2
+
+
+class _RecordingBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self):
+        self.connected = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.connected.append(host)
+        raise httpcore.ConnectError("recorded")
+
+
+def test_pinned_backend_connects_to_the_validated_address(monkeypatch):
+    # 校验用的解析结果就是连接的地址：主机名之后解析到哪里都不会再被使用
+    async def getaddrinfo(self, host, port, **kwargs):
+        return [(None, None, None, "", (PUBLIC_HOST, port))]
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+    inner = _RecordingBackend()
+    with pytest.raises(httpcore.ConnectError):
+        asyncio.run(PinnedNetworkBackend(check_public_address, inner).connect_tcp("rebind.example", 80))
+    assert inner.connected == [PUBLIC_HOST]
+
+
+def test_pinned_backend_refuses_private_resolution():
+    inner = _RecordingBackend()
+    with pytest.raises(UnsafeURLError):
+        asyncio.run(PinnedNetworkBackend(check_public_address, inner).connect_tcp("localhost", 80))
+    assert inner.connected == []
+
+
+def test_client_checks_the_address_it_connects_to():
+    async def run():
+        client = HttpClient(check_address=check_public_address)
+        try:
+            await client.get_capped("http://localhost:9/", 1024)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(UnsafeURLError):
+        asyncio.run(run())
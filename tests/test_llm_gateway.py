@@ -0,0 +1,63 @@
+import asyncio
+import random
+
+from llm_gateway import AdaptiveLimiter, LLMGateway
+
+
+def _limiter(**overrides):
+    options = dict(min_limit=1, max_limit=8, initial_limit=4, latency_tolerance=2.0, backoff_ratio=0.7, decrease_cooldown=0)
+    options.update(overrides)
+    return AdaptiveLimiter("test", **options)
+
+
+def test_steady_mixed_workload_does_not_shrink_limit():
+    # 提示长、输出短的 map 调用（约 2 ms/token）与输出长的报告调用（约 18 ms/token）交替出现，后端负载不变
+    rng = random.Random(0)
+    limiter = _limiter()
+    for i in range(40):
+        jitter = rng.uniform(0.9, 1.1)
+        if i % 2:
+            limiter.on_success(2100 * 0.002 * jitter, 2000, 100, saturated=False)
+        else:
+            limiter.on_success(1100 * 0.018 * jitter, 300, 800, saturated=False)
+    assert limiter.decreases == 0
+    assert limiter.limit == 4
+
+
+def test_slowdown_of_same_shape_shrinks_limit():
+    limiter = _limiter()
+    for _ in range(5):
+        limiter.on_success(4.0, 2000, 100, saturated=False)
+    limiter.on_success(10.0, 2000, 100, saturated=False)
+    assert limiter.decreases == 1
+    assert limiter.limit < 4
+
+
+def test_streaming_signal_is_decode_time_per_output_token():
+    limiter = _limiter()
+    # 首个输出前的预填充时间随提示长度变化，不影响解码信号
+    for prompt_tokens, total, decode in [(200, 2.0, 1.9), (4000, 6.0, 2.0), (100, 1.9, 1.9), (3000, 5.0, 1.95), (500, 2.5, 2.0), (6000, 8.0, 2.0)]:
+        limiter.on_success(total, prompt_tokens, 100, saturated=False, decode_time=decode)
+    assert limiter.decreases == 0
+    limiter.on_success(8.0, 200, 100, saturated=False, decode_time=7.5)
+    assert limiter.decreases == 1
+
+
+def test_gateway_reports_prompt_and_completion_tokens():
+    class Usage:
+        prompt_tokens = 1500
+        completion_tokens = 40
+        total_tokens = 1540
+
+    class Response:
+        completion = "ok"
+        usage = Usage()
+
+    class Model:
+        async def ainvoke(self, messages, output_format=None, **kwargs):
+            return Response()
+
+    gateway = LLMGateway(initial_concurrency=2)
+    asyncio.run(gateway.ainvoke("backend", Model(), ["prompt"]))
+    limiter = gateway.limiter("backend")
+    assert list(limiter.samples) == [(limiter._bucket(1500), limiter._bucket(40))]
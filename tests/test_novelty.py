@@ -0,0 +1,47 @@
+import pytest
+
+import novelty
+from novelty import has_converged, novelty_score, source_novelty, text_novelty
+
+FINDINGS = "solar panels convert sunlight into electricity with silicon cells"
+
+
+def test_text_novelty_bounds():
+    assert text_novelty("", FINDINGS) == 1.0
+    assert text_novelty(FINDINGS, FINDINGS) == 0.0
+    assert text_novelty(FINDINGS, "") == 0.0
+    assert 0.0 < text_novelty(FINDINGS, FINDINGS + " and perovskite layers raise efficiency") < 1.0
+
+
+def test_source_novelty_counts_first_seen_urls():
+    assert source_novelty(["https://a.example"], ["https://a.example", "https://b.example"]) == 0.5
+    assert source_novelty(["https://a.example"], []) == 0.0
+
+
+def test_novelty_score_weights_findings_and_sources(monkeypatch):
+    monkeypatch.setattr(novelty, "NOVELTY_SOURCE_WEIGHT", 0.25)
+    entry = novelty_score(FINDINGS, FINDINGS, ["https://a.example"], ["https://b.example"], iteration=2)
+    assert entry == {"iteration": 2, "findings_novelty": 0.0, "source_novelty": 1.0, "score": 0.25}
+
+
+@pytest.fixture
+def convergence(monkeypatch):
+    monkeypatch.setattr(novelty, "NOVELTY_THRESHOLD", 0.2)
+    monkeypatch.setattr(novelty, "NOVELTY_MIN_ITERATIONS", 2)
+    monkeypatch.setattr(novelty, "NOVELTY_PATIENCE", 2)
+
+
+def _scores(*values):
+    return [{"iteration": i, "score": v} for i, v in enumerate(values, 1)]
+
+
+def test_converges_after_patience_low_scores(convergence):
+    assert has_converged(_scores(0.9, 0.1, 0.05), iteration=3)
+    # 最近的得分中有一轮仍高于阈值
+    assert not has_converged(_scores(0.1, 0.5, 0.05), iteration=3)
+
+
+def test_no_convergence_before_min_iterations_or_when_disabled(convergence):
+    assert not has_converged(_scores(0.1, 0.1), iteration=1)
+    assert not has_converged(_scores(0.1), iteration=2)
+    assert not has_converged(_scores(0.1, 0.1, 0.1), iteration=3, early_stop=False)
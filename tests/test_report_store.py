@@ -0,0 +1,21 @@
+from report_store import ReportStore
+
+
+def _save(store, run_id, report, error=None):
+    store.save(run_id, "量子计算进展", report, "2026-01-01T00:00:00", 1.0, error=error)
+
+
+def test_saving_same_run_again_replaces_search_index(tmp_path):
+    store = ReportStore(str(tmp_path / "reports.sqlite3"), max_count=100, retention_days=0)
+    _save(store, "run-1", "研究出错: connection refused", error="connection refused")
+    assert [r["run_id"] for r in store.search("connection refused")] == ["run-1"]
+
+    _save(store, "run-1", "超导量子比特的最新研究进展报告")
+    assert store.search("connection refused") == []
+    assert [r["run_id"] for r in store.search("超导量子比特")] == ["run-1"]
+    assert store.get("run-1")["error"] is None
+    assert len(store.list()["reports"]) == 1
+    if store.fts_enabled:
+        # 全文索引中不应残留旧内容：integrity-check 会对照 reports 表校验索引
+        assert store._conn.execute("SELECT rowid FROM reports_fts WHERE reports_fts MATCH ?", ('"connection refused"',)).fetchall() == []
+        store._conn.execute("INSERT INTO reports_fts (reports_fts, rank) VALUES ('integrity-check', 1)")
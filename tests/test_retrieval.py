@@ -0,0 +1,45 @@
+import retrieval
+from retrieval import BM25Index
+
+
+def test_evicted_source_is_dropped_and_can_be_reindexed():
+    index = BM25Index(max_chunks=2)
+    index.add_document("https://a.example", "alpha beta gamma")
+    index.add_document("https://b.example", "delta epsilon")
+    index.add_document("https://c.example", "zeta eta theta")
+    assert set(index.sources) == {"https://b.example", "https://c.example"}
+    assert index.add_document("https://a.example", "alpha beta gamma") == 1
+    assert set(index.sources) == {"https://a.example", "https://c.example"}
+
+
+def test_source_with_no_terms_is_not_recorded():
+    index = BM25Index()
+    assert index.add_document("https://empty.example", "。！？") == 0
+    assert "https://empty.example" not in index.sources
+
+
+def test_retrieve_passages_limited_to_given_sources(monkeypatch):
+    monkeypatch.setattr(retrieval, "global_index", None)
+    run_id = "test-retrieval-scope"
+    try:
+        retrieval.index_document(run_id, "https://round1.example", "solar panel efficiency record")
+        retrieval.index_document(run_id, "https://round2.example", "solar panel recycling cost")
+        everything = retrieval.retrieve_passages(run_id, "solar panel", 1000)
+        this_round = retrieval.retrieve_passages(run_id, "solar panel", 1000, {"https://round2.example"})
+    finally:
+        retrieval.release_run_index(run_id)
+    assert {p["source"] for p in everything} == {"https://round1.example", "https://round2.example"}
+    assert [p["source"] for p in this_round] == ["https://round2.example"]
+
+
+def test_global_index_only_adds_sources_outside_the_run(monkeypatch):
+    monkeypatch.setattr(retrieval, "global_index", BM25Index())
+    run_id = "test-retrieval-global"
+    try:
+        retrieval.global_index.add_document("https://other-run.example", "wind turbine blade design")
+        retrieval.index_document(run_id, "https://round1.example", "wind turbine maintenance")
+        retrieval.index_document(run_id, "https://round2.example", "wind turbine noise")
+        passages = retrieval.retrieve_passages(run_id, "wind turbine", 1000, {"https://round2.example"})
+    finally:
+        retrieval.release_run_index(run_id)
+    assert {p["source"] for p in passages} == {"https://round2.example", "https://other-run.example"}
@@ -0,0 +1,106 @@
+import asyncio
+
+from scheduler import QueueFullError, ResearchScheduler
+
+
+def test_cancelled_job_counts_as_failed_and_worker_keeps_running():
+    async def run():
+        scheduler = ResearchScheduler(max_workers=1, max_queue=10, max_per_client=10)
+        finished = asyncio.Event()
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def succeeds():
+            finished.set()
+
+        await scheduler.submit("cancelled", cancelled)
+        await scheduler.submit("succeeds", succeeds)
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
+    assert stats["running"] == 0
+    assert stats["active_clients"] == 0
+
+
+async def _run_gated(submissions, max_queue=10, max_per_client=10):
+    # 单个工作协程先执行一个阻塞的任务，其余任务全部排队后再放行，返回各任务的排队位置与实际执行顺序
+    scheduler = ResearchScheduler(max_workers=1, max_queue=max_queue, max_per_client=max_per_client)
+    started, release = asyncio.Event(), asyncio.Event()
+    order = []
+
+    async def gate():
+        started.set()
+        await release.wait()
+
+    def job(job_id):
+        async def run():
+            order.append(job_id)
+        return run
+
+    await scheduler.submit("gate", gate, client_id="gate")
+    await asyncio.wait_for(started.wait(), 1)
+    for job_id, client_id, priority in submissions:
+        await scheduler.submit(job_id, job(job_id), client_id=client_id, priority=priority)
+    positions = {job_id: scheduler.position(job_id) for job_id, _, _ in submissions}
+    positions["gate"] = scheduler.position("gate")
+    release.set()
+    while len(order) < len(submissions):
+        await asyncio.sleep(0)
+    return positions, order
+
+
+def test_fair_queuing_interleaves_clients():
+    submissions = [("a1", "a", 0), ("a2", "a", 0), ("a3", "a", 0), ("b1", "b", 0), ("b2", "b", 0)]
+    positions, order = asyncio.run(_run_gated(submissions))
+    # 客户端 a 的突发提交不会排在客户端 b 前面
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+    assert positions == {"a1": 1, "b1": 2, "a2": 3, "b2": 4, "a3": 5, "gate": None}
+
+
+def test_priority_takes_precedence_over_fair_order():
+    submissions = [("a1", "a", 0), ("b1", "b", 1), ("c1", "c", 0)]
+    positions, order = asyncio.run(_run_gated(submissions))
+    assert order == ["a1", "c1", "b1"]
+    assert positions["b1"] == 3
+
+
+def test_admission_limits_reject_with_queue_full():
+    async def run():
+        scheduler = ResearchScheduler(max_workers=1, max_queue=2, max_per_client=2)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        errors = []
+        await scheduler.submit("running", blocked, client_id="a")
+        await asyncio.sleep(0)
+        await scheduler.submit("queued", blocked, client_id="a")
+        # 客户端 a 已有 1 个运行中、1 个排队中的研究
+        try:
+            await scheduler.submit("a-extra", blocked, client_id="a")
+        except QueueFullError as e:
+            errors.append(str(e))
+        await scheduler.submit("b1", blocked, client_id="b")
+        # 排队数已达 max_queue
+        try:
+            await scheduler.submit("c1", blocked, client_id="c")
+        except QueueFullError as e:
+            errors.append(str(e))
+        stats = scheduler.stats()
+        release.set()
+        return errors, stats, scheduler.position("a-extra")
+
+    errors, stats, rejected_position = asyncio.run(run())
+    assert len(errors) == 2
+    assert "2 个研究" in errors[0]
+    assert "队列已满" in errors[1]
+    assert stats["rejected"] == 2
+    assert stats["queue_depth"] == 2
+    assert stats["running"] == 1
+    assert rejected_position is None
@@ -0,0 +1,40 @@
+import itertools
+
+import search_cache as search_cache_module
+from search_cache import SearchCache, normalize_query
+
+
+def _clock(monkeypatch, start=1000.0):
+    # 每次读取时间递增 1 秒，使访问顺序与 last_access 一一对应
+    ticks = itertools.count(start)
+    monkeypatch.setattr(search_cache_module.time, "time", lambda: next(ticks))
+
+
+def test_normalize_query_folds_width_case_and_punctuation():
+    assert normalize_query("  ＡＩ   Agents？ ") == "ai agents"
+    assert SearchCache.make_key("AI agents", "zh-CN", ["Bing", "google"]) == SearchCache.make_key("ai  agents!", "zh-CN", ["google", "bing"])
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    _clock(monkeypatch)
+    cache = SearchCache(str(tmp_path / "search.sqlite3"), ttl=5, max_entries=10)
+    cache.put("solar", "zh-CN", None, [{"url": "https://a.example"}])
+    assert cache.get("solar", "zh-CN") == [{"url": "https://a.example"}]
+    monkeypatch.setattr(search_cache_module.time, "time", lambda: 2000.0)
+    assert cache.get("solar", "zh-CN") is None
+    assert cache.expired == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, monkeypatch):
+    _clock(monkeypatch)
+    cache = SearchCache(str(tmp_path / "search.sqlite3"), ttl=3600, max_entries=2)
+    cache.put("first", "zh-CN", None, [{"url": "https://1.example"}])
+    cache.put("second", "zh-CN", None, [{"url": "https://2.example"}])
+    # 读取 first 后，second 成为最久未使用的条目
+    assert cache.get("first", "zh-CN") is not None
+    cache.put("third", "zh-CN", None, [{"url": "https://3.example"}])
+    assert cache.get("second", "zh-CN") is None
+    assert cache.get("first", "zh-CN") is not None
+    assert cache.get("third", "zh-CN") is not None
+    assert cache.evictions == 1
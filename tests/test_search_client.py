@@ -0,0 +1,187 @@
+import asyncio
+
+import httpx
+import pytest
+
+import search
+from http_client import HttpClient
+from search import BackendPool
+
+
+def _first_candidate(monkeypatch):
+    # 关闭加权随机选择：总是选第一个可用实例，便于断言主请求/对冲请求落在哪个实例
+    monkeypatch.setattr(search.random, "choices", lambda candidates, weights, k: [candidates[0]])
+
+
+def _results(host):
+    return {"results": [{"title": host, "content": host, "url": f"https://{host}/page"}]}
+
+
+def test_per_host_limit_caps_concurrency():
+    active = {"now": 0, "max": 0}
+
+    async def handler(request):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.02)
+        active["now"] -= 1
+        return httpx.Response(200, json=_results(request.url.host))
+
+    async def run():
+        client = HttpClient(per_host_limit=2, transport=httpx.MockTransport(handler))
+        await asyncio.gather(*(client.get_json("http://a.test/search") for _ in range(6)))
+        await client.aclose()
+
+    asyncio.run(run())
+    assert active["max"] == 2
+
+
+def test_hedged_request_wins_against_slow_primary(monkeypatch):
+    _first_candidate(monkeypatch)
+
+    async def handler(request):
+        if request.url.host == "slow.test":
+            await asyncio.sleep(1)
+        return httpx.Response(200, json=_results(request.url.host))
+
+    async def run():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        pool = BackendPool(["http://slow.test", "http://fast.test"], client=client, hedge_min_delay=0.05)
+        # 主实例的历史 p95 为 50ms，超过后即发起对冲
+        pool.backends[0].latencies.extend([0.05] * 20)
+        start = asyncio.get_running_loop().time()
+        data = await pool.get_json({"q": "x"})
+        elapsed = asyncio.get_running_loop().time() - start
+        await client.aclose()
+        return pool, data, elapsed
+
+    pool, data, elapsed = asyncio.run(run())
+    assert data["results"][0]["title"] == "fast.test"
+    assert elapsed < 0.5
+    assert pool.hedged_requests == 1
+    assert pool.hedge_wins == 1
+    # 被取代的慢请求不计为失败
+    assert pool.backends[0].failures == 0
+
+
+def test_failover_and_circuit_breaker(monkeypatch):
+    _first_candidate(monkeypatch)
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.host)
+        if request.url.host == "down.test":
+            return httpx.Response(503)
+        return httpx.Response(200, json=_results(request.url.host))
+
+    async def run():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        pool = BackendPool(["http://down.test", "http://up.test"], client=client, hedge_min_delay=5,
+                           breaker_failures=2, breaker_cooldown=0.1)
+        for _ in range(3):
+            data = await pool.get_json({"q": "x"})
+            assert data["results"][0]["title"] == "up.test"
+        down = pool.backends[0]
+        opened = down.state
+        # 熔断期间不再请求故障实例
+        calls.clear()
+        await pool.get_json({"q": "x"})
+        skipped = calls == ["up.test"]
+        # 冷却期过后放行一次半开探测，探测失败重新熔断
+        await asyncio.sleep(0.15)
+        calls.clear()
+        await pool.get_json({"q": "x"})
+        await client.aclose()
+        return pool, opened, skipped, list(calls), down.state
+
+    pool, opened, skipped, probe_calls, state_after_probe = asyncio.run(run())
+    assert opened == "open"
+    assert skipped
+    assert probe_calls == ["down.test", "up.test"]
+    assert state_after_probe == "open"
+    assert pool.failovers == 3
+
+
+def test_all_backends_open_raises(monkeypatch):
+    _first_candidate(monkeypatch)
+
+    async def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    async def run():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        pool = BackendPool(["http://a.test"], client=client, breaker_failures=1, breaker_cooldown=60)
+        with pytest.raises(httpx.ConnectError):
+            await pool.get_json({"q": "x"})
+        with pytest.raises(RuntimeError):
+            await pool.get_json({"q": "x"})
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_half_open_backend_gets_a_single_probe(monkeypatch):
+    _first_candidate(monkeypatch)
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.host)
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json=_results(request.url.host))
+
+    async def run():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        pool = BackendPool(["http://recovering.test", "http://up.test"], client=client, hedge_min_delay=5,
+                           breaker_failures=1, breaker_cooldown=0.05)
+        recovering = pool.backends[0]
+        recovering.state, recovering.opened_at = "open", 0.0
+        # 同一轮事件循环中并发的多个搜索，只有一个落到冷却期已过的实例上
+        await asyncio.gather(*(pool.get_json({"q": str(i)}) for i in range(3)))
+        await client.aclose()
+        return recovering.state
+
+    state = asyncio.run(run())
+    assert calls.count("recovering.test") == 1
+    assert calls.count("up.test") == 2
+    assert state == "closed"
+
+
+def test_cancelled_probe_restarts_cooldown():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, json=_results(request.url.host))
+
+    async def run():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        pool = BackendPool(["http://recovering.test"], client=client, breaker_cooldown=60)
+        backend = pool.backends[0]
+        backend.state, backend.opened_at = "open", 0.0
+        assert backend.available()
+        backend.on_start()
+        task = asyncio.ensure_future(pool._request(backend, {"q": "x"}))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await client.aclose()
+        return backend
+
+    backend = asyncio.run(run())
+    assert backend.state == "open"
+    assert not backend.available()
+    assert backend.failures == 0
+
+
+def test_reciprocal_rank_fusion_prefers_results_ranked_high_by_several_queries():
+    def items(*urls):
+        return [{"url": url, "title": url} for url in urls]
+
+    fused = search.reciprocal_rank_fusion([
+        items("https://a.example", "https://b.example", "https://c.example"),
+        items("https://b.example", "https://d.example"),
+        # 没有 URL 的结果被忽略
+        items("https://b.example", "https://a.example") + [{"url": "", "title": "no url"}],
+    ], k=60)
+    assert [item["url"] for item in fused] == ["https://b.example", "https://a.example", "https://d.example", "https://c.example"]
+    assert [item["url"] for item in search.reciprocal_rank_fusion([items("https://a.example", "https://b.example")], limit=1)] == ["https://a.example"]
+    assert search.reciprocal_rank_fusion([]) == []
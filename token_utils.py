@@ -0,0 +1,59 @@
+import re
+from contextvars import ContextVar, Token
+from typing import Dict, Optional, Tuple
+
+_CJK_RE = re.compile("[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text) -> int:
+    # 粗略估算：中日韩字符约 1 字符 1 token，其余约 4 字符 1 token
+    if not text:
+        return 0
+    text = str(text)
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 当前节点的 LLM 用量计数器（由 budget.metered 为每次节点执行设置），未设置时不计数
+_usage_meter: ContextVar[Optional[Dict[str, int]]] = ContextVar("usage_meter", default=None)
+
+
+def start_usage_meter() -> Tuple[Dict[str, int], Token]:
+    meter = {"tokens": 0, "calls": 0}
+    return meter, _usage_meter.set(meter)
+
+
+def stop_usage_meter(token: Token):
+    _usage_meter.reset(token)
+
+
+def count_llm_tokens(messages, completion, usage=None) -> int:
+    # 模型返回用量时按实际值计，否则按提示与输出文本估算
+    total = getattr(usage, "total_tokens", None) if usage is not None else None
+    if total is None:
+        total = sum(estimate_tokens(getattr(m, "content", m)) for m in messages) + estimate_tokens(completion)
+    return total
+
+
+def llm_payload(messages, completion, usage=None) -> Dict[str, int]:
+    # 单次 LLM 调用的提示/输出 token 数（模型返回用量时按实际值，否则估算）与字符数，供追踪记录
+    prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    completion_tokens = getattr(usage, "completion_tokens", None) if usage is not None else None
+    return {
+        "prompt_tokens": prompt_tokens if prompt_tokens is not None else sum(estimate_tokens(getattr(m, "content", m)) for m in messages),
+        "completion_tokens": completion_tokens if completion_tokens is not None else estimate_tokens(completion),
+        "prompt_chars": sum(len(str(getattr(m, "content", m))) for m in messages),
+        "completion_chars": len(completion or ""),
+    }
+
+
+def current_usage() -> Optional[Dict[str, int]]:
+    return _usage_meter.get()
+
+
+def record_llm_usage(messages, completion, usage=None):
+    meter = _usage_meter.get()
+    if meter is None:
+        return
+    meter["tokens"] += count_llm_tokens(messages, completion, usage)
+    meter["calls"] += 1
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Any, Optional
+
+# 当前研究的追踪记录与当前所在的 span（由 TraceStore.activate 设置），未设置时 span 不做任何记录
+_current_trace: ContextVar[Optional["RunTrace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_span", default=None)
+# span 结束时的回调（见 add_span_observer）
+_span_observers: List[Callable[[Dict[str, Any]], None]] = []
+
+# 汇总时不求和的数值属性（标识或参数，而非用量）
+NON_ADDITIVE_ATTRS = {"iteration", "num_results", "attempt"}
+
+
+class RunTrace:
+    """单次研究的 span 列表：每个 span 记录名称、类别（run / node / llm / search / fetch）、起止时间、父 span 与属性。"""
+
+    def __init__(self, run_id: str, max_spans: int):
+        self.run_id = run_id
+        self.max_spans = max_spans
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+        # 起始时间统一由单调时钟换算，保证父子 span 的先后与嵌套关系准确
+        self._wall0 = time.time()
+        self._perf0 = time.perf_counter()
+
+    def begin(self, name: str, category: str, attrs: Dict[str, Any], parent: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        with self._lock:
+            record = {
+                "id": self._next_id,
+                "parent": parent["id"] if parent else None,
+                "name": name,
+                "cat": category,
+                "start": self._wall0 + (t0 - self._perf0),
+                "duration": None,
+                "attrs": attrs,
+                "_t0": t0,
+            }
+            self._next_id += 1
+            # 超过上限的 span 只计数不保存，避免异常长的研究占用过多内存
+            if len(self.spans) < self.max_spans:
+                self.spans.append(record)
+            else:
+                self.dropped += 1
+        return record
+
+    @staticmethod
+    def end(record: Dict[str, Any]):
+        record["duration"] = time.perf_counter() - record["_t0"]
+
+    def _finished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            spans = list(self.spans)
+        now = time.perf_counter()
+        # 尚未结束的 span 按当前时间计算时长
+        return [{**s, "duration": s["duration"] if s["duration"] is not None else now - s["_t0"]} for s in spans]
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """导出为 Chrome trace 事件格式（chrome://tracing、Perfetto 可直接打开）。
+
+        并发的 span 分配到不同的 lane（tid）：优先放在父 span 所在且能容纳它的 lane，其次放在空闲 lane，
+        同一 lane 内的 span 严格嵌套，保证火焰图正确显示。
+        """
+        spans = sorted(self._finished(), key=lambda s: (s["start"], -s["duration"]))
+        origin = spans[0]["start"] if spans else time.time()
+        lanes: List[List[tuple]] = []
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": f"research {self.run_id}"}}]
+        for s in spans:
+            start, end = s["start"] - origin, s["start"] - origin + s["duration"]
+            for stack in lanes:
+                while stack and stack[-1][0] <= start:
+                    stack.pop()
+            tid = next((i for i, stack in enumerate(lanes) if stack and stack[-1][1] == s["parent"] and stack[-1][0] >= end), None)
+            if tid is None:
+                tid = next((i for i, stack in enumerate(lanes) if not stack), None)
+            if tid is None:
+                tid = len(lanes)
+                lanes.append([])
+            lanes[tid].append((end, s["id"]))
+            events.append({
+                "name": s["name"],
+                "cat": s["cat"],
+                "ph": "X",
+                "ts": round(start * 1e6),
+                "dur": round(s["duration"] * 1e6),
+                "pid": 1,
+                "tid": tid + 1,
+                "args": {**s["attrs"], "span_id": s["id"], "parent_id": s["parent"]},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"run_id": self.run_id, "dropped_spans": self.dropped}}
+
+    def otel(self) -> Dict[str, Any]:
+        """导出为 OpenTelemetry OTLP/JSON（ResourceSpans），可直接发送到 collector 的 /v1/traces。"""
+        trace_id = self.run_id if re.fullmatch(r"[0-9a-f]{32}", self.run_id) else hashlib.sha256(self.run_id.encode("utf-8")).hexdigest()[:32]
+        spans = []
+        for s in self._finished():
+            span = {
+                "traceId": trace_id,
+                "spanId": f"{s['id']:016x}",
+                "name": s["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(int(s["start"] * 1e9)),
+                "endTimeUnixNano": str(int((s["start"] + s["duration"]) * 1e9)),
+                "attributes": [{"key": "category", "value": {"stringValue": s["cat"]}}]
+                              + [{"key": k, "value": _otel_value(v)} for k, v in s["attrs"].items() if v is not None],
+                "status": {"code": 2, "message": s["attrs"]["error"]} if s["attrs"].get("error") else {"code": 0},
+            }
+            if s["parent"] is not None:
+                span["parentSpanId"] = f"{s['parent']:016x}"
+            spans.append(span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "hasakiDR"}},
+                                        {"key": "research.run_id", "value": {"stringValue": self.run_id}}]},
+            "scopeSpans": [{"scope": {"name": "hasakiDR.tracing"}, "spans": spans}],
+        }]}
+
+    def profile(self, slowest: int = 10) -> Dict[str, Any]:
+        """按类别与节点汇总耗时；数值属性（token、字节、结果数）求和，布尔属性（如 cache_hit）计数。"""
+        spans = self._finished()
+        if not spans:
+            return {"run_id": self.run_id, "spans": 0, "dropped_spans": self.dropped, "wall_seconds": 0,
+                    "categories": {}, "nodes": {}, "slowest": []}
+        origin = min(s["start"] for s in spans)
+        wall = max(s["start"] + s["duration"] for s in spans) - origin
+        categories: Dict[str, Dict[str, Any]] = {}
+        nodes: Dict[str, Dict[str, Any]] = {}
+        for s in spans:
+            _accumulate(categories.setdefault(s["cat"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0}), s)
+            if s["cat"] == "node":
+                _accumulate(nodes.setdefault(s["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0}), s)
+        for entry in list(categories.values()) + list(nodes.values()):
+            entry["seconds"] = round(entry["seconds"], 3)
+            entry["max_seconds"] = round(entry["max_seconds"], 3)
+            # 同类 span 可能并发执行，share 为其总时长占整次研究墙钟时间的比例（可超过 1）
+            entry["share"] = round(entry["seconds"] / wall, 3) if wall else None
+        top = sorted((s for s in spans if s["cat"] != "run"), key=lambda s: s["duration"], reverse=True)[:slowest]
+        return {
+            "run_id": self.run_id,
+            "spans": len(spans),
+            "dropped_spans": self.dropped,
+            "wall_seconds": round(wall, 3),
+            "categories": categories,
+            "nodes": nodes,
+            "slowest": [{"name": s["name"], "category": s["cat"], "offset": round(s["start"] - origin, 3),
+                         "seconds": round(s["duration"], 3), "attrs": s["attrs"]} for s in top],
+        }
+
+
+def _accumulate(entry: Dict[str, Any], span: Dict[str, Any]):
+    entry["count"] += 1
+    entry["seconds"] += span["duration"]
+    entry["max_seconds"] = max(entry["max_seconds"], span["duration"])
+    for key, value in span["attrs"].items():
+        if key in NON_ADDITIVE_ATTRS:
+            continue
+        if isinstance(value, bool):
+            entry[key] = entry.get(key, 0) + int(value)
+        elif isinstance(value, (int, float)):
+            entry[key] = round(entry.get(key, 0) + value, 3)
+
+
+def _otel_value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class TraceStore:
+    """按 run_id 保存最近 max_runs 次研究的追踪记录（LRU），恢复执行的研究继续追加到原记录。"""
+
+    def __init__(self, enabled: bool = True, max_runs: int = 100, max_spans: int = 5000):
+        self.enabled = enabled
+        self.max_runs = max_runs
+        self.max_spans = max_spans
+        self._traces: "OrderedDict[str, RunTrace]" = OrderedDict()
+
+    def get(self, run_id: str) -> Optional[RunTrace]:
+        return self._traces.get(run_id)
+
+    @contextmanager
+    def activate(self, run_id: str):
+        # 在该上下文（及其创建的任务）中产生的 span 都记录到此研究
+        if not self.enabled:
+            yield None
+            return
+        trace = self._traces.get(run_id)
+        if trace is None:
+            trace = self._traces[run_id] = RunTrace(run_id, self.max_spans)
+        self._traces.move_to_end(run_id)
+        while len(self._traces) > self.max_runs:
+            self._traces.popitem(last=False)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+
+def add_span_observer(observer: Callable[[Dict[str, Any]], None]):
+    # 每个 span 结束时以 span 记录调用 observer（如运行指标），没有进行中的追踪时同样调用
+    _span_observers.append(observer)
+
+
+def _begin(name: str, category: str, attrs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    trace = _current_trace.get()
+    if trace is not None:
+        return trace.begin(name, category, attrs, _current_span.get())
+    if not _span_observers:
+        return None
+    # 不在研究中（如 /plan）的调用只计时，供 observer 使用，不保存
+    return {"id": None, "parent": None, "name": name, "cat": category, "start": None, "duration": None,
+            "attrs": attrs, "_t0": time.perf_counter()}
+
+
+def _end(record: Dict[str, Any]):
+    RunTrace.end(record)
+    for observer in _span_observers:
+        observer(record)
+
+
+def _mark_exception(attrs: Dict[str, Any], error: BaseException):
+    # 取消（如丢弃的预取）不算出错
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        attrs["cancelled"] = True
+    else:
+        attrs["error"] = f"{type(error).__name__}: {error}"[:200]
+
+
+@contextmanager
+def span(name: str, category: str, **attrs):
+    """记录一个 span，返回的属性字典可在执行过程中补充（如 token 数、是否命中缓存）。"""
+    record = _begin(name, category, attrs)
+    if record is None:
+        yield attrs
+        return
+    token = _current_span.set(record)
+    try:
+        yield attrs
+    except BaseException as e:
+        _mark_exception(attrs, e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _end(record)
+
+
+def begin_span(name: str, category: str, **attrs) -> Optional[Dict[str, Any]]:
+    # 用于异步生成器等跨 yield 的场景：不切换当前 span，调用方负责 end_span
+    return _begin(name, category, attrs)
+
+
+def end_span(record: Optional[Dict[str, Any]], error: Optional[BaseException] = None, **attrs):
+    if record is not None:
+        record["attrs"].update(attrs)
+        if error is not None:
+            _mark_exception(record["attrs"], error)
+        _end(record)
+
+
+def annotate_span(**attrs):
+    # 给当前 span 补充属性（没有进行中的追踪或 observer 时忽略）
+    record = _current_span.get()
+    if record is not None:
+        record["attrs"].update(attrs)